@@ -0,0 +1,113 @@
+"""
+Seeded generators of synthetic JSON documents for benchmarks.
+
+Every generator takes a random.Random instance, so the same seed always
+produces the same documents.
+"""
+
+import copy
+
+_WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+
+def scalar(rng):
+    r = rng.random()
+    if r < 0.3:
+        return rng.randint(0, 100000)
+    elif r < 0.5:
+        return round(rng.uniform(-1000, 1000), 3)
+    elif r < 0.9:
+        return rng.choice(_WORDS) + str(rng.randint(0, 999))
+    elif r < 0.95:
+        return rng.random() < 0.5
+    return None
+
+def record(rng, fields=8):
+    """ A flat object like a row of a table with an id field """
+    rec = { 'id': rng.randint(0, 10**9) }
+    for i in range(fields - 1):
+        rec[f'field{i}'] = scalar(rng)
+    return rec
+
+def wide_object(rng, n):
+    """ An object with n keys holding small nested values """
+    doc = {}
+    for i in range(n):
+        r = rng.random()
+        if r < 0.6:
+            doc[f'key{i}'] = scalar(rng)
+        elif r < 0.85:
+            doc[f'key{i}'] = record(rng, 4)
+        else:
+            doc[f'key{i}'] = [scalar(rng) for _ in range(rng.randint(0, 6))]
+    return doc
+
+def deep_nesting(rng, depth):
+    """ Objects and arrays nested depth levels deep with a few scalars on every level """
+    doc = { 'value': scalar(rng) }
+    for i in range(depth):
+        if i % 2:
+            doc = [scalar(rng), doc, scalar(rng)]
+        else:
+            doc = { 'level': i, 'name': scalar(rng), 'child': doc }
+    return doc
+
+def nested_arrays(rng, depth, rate=0):
+    """
+    Objects holding an array with a single object, nested depth levels deep.
+    rate is the probability that the name on a level is changed, the documents
+    generated with the same seed differ only by the changed names.
+    """
+    doc = { 'value': scalar(rng) }
+    for i in range(depth):
+        name = scalar(rng)
+        changed = scalar(rng)
+        if rng.random() < rate:
+            name = changed
+        doc = { 'level': i, 'name': name, 'items': [doc] }
+    return doc
+
+def scalar_array(rng, n):
+    """ An array of n scalars """
+    return [scalar(rng) for _ in range(n)]
+
+def record_array(rng, n, fields=8):
+    """ An array of n records """
+    return [record(rng, fields) for _ in range(n)]
+
+def mutate(rng, doc, rate):
+    """
+    Return a modified deep copy of doc, rate is the probability that a value,
+    object key or array element is changed, removed or added
+    """
+    return _mutate(rng, copy.deepcopy(doc), rate)
+
+def _mutate(rng, value, rate):
+    if isinstance(value, dict):
+        for key in list(value):
+            r = rng.random()
+            if r < rate / 3:
+                del value[key]
+            elif r < rate:
+                value[key] = scalar(rng)
+            else:
+                value[key] = _mutate(rng, value[key], rate)
+        if rng.random() < rate:
+            value[f'added{rng.randint(0, 10**6)}'] = scalar(rng)
+        return value
+    elif isinstance(value, list):
+        result = []
+        for item in value:
+            r = rng.random()
+            if r < rate / 3:
+                continue
+            elif r < rate * 2 / 3:
+                result.append(scalar(rng))
+            elif r < rate:
+                result.append(_mutate(rng, item, rate))
+                result.append(copy.deepcopy(item))
+                continue
+            result.append(_mutate(rng, item, rate))
+        return result
+    elif rng.random() < rate:
+        return scalar(rng)
+    return value
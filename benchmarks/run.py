@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of Comparator, the formatters and the command line tool.
+
+    python3 benchmarks/run.py run -o results.json
+    python3 benchmarks/run.py compare baseline.json results.json
+
+Every case generates a pair of documents from a fixed seed and measures
+the wall time and the peak memory of diff(), JSONFormatter, YAMLFormatter
+and of the CLI comparing the documents saved as files. Times are the best of
+--repeat runs, peak memory of the Python stages is measured by tracemalloc
+in a separate run and of the CLI as the maximum resident set size.
+"""
+
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import struct_diff
+from struct_diff import diff, JSONFormatter, YAMLFormatter
+
+from struct_diff.__main__ import JSON_RECURSION_LIMIT
+import generators as gen
+
+# change rates of mostly equal and mostly different pairs
+EQUAL_RATE = 0.01
+DIFFERENT_RATE = 0.3
+
+def _pair(make, rate):
+    def make_pair(rng, scale):
+        doc = make(rng, scale)
+        return doc, gen.mutate(rng, doc, rate)
+    return make_pair
+
+def _nested_pair(depth, rate):
+    # too deep for mutate(), both documents are generated from the same seed
+    def make_pair(rng, scale):
+        seed = rng.getrandbits(32)
+        return gen.nested_arrays(random.Random(seed), depth * scale), \
+            gen.nested_arrays(random.Random(seed), depth * scale, rate)
+    return make_pair
+
+CASES = {
+    'wide_object/equal': _pair(lambda rng, s: gen.wide_object(rng, 20000 * s), EQUAL_RATE),
+    'wide_object/different': _pair(lambda rng, s: gen.wide_object(rng, 20000 * s), DIFFERENT_RATE),
+    'deep_nesting/equal': _pair(lambda rng, s: [gen.deep_nesting(rng, 150) for _ in range(20 * s)], EQUAL_RATE),
+    'deep_nesting/different': _pair(lambda rng, s: [gen.deep_nesting(rng, 150) for _ in range(20 * s)], DIFFERENT_RATE),
+    'nested_arrays/equal': _nested_pair(5000, EQUAL_RATE),
+    'nested_arrays/different': _nested_pair(5000, DIFFERENT_RATE),
+    'scalar_array/equal': _pair(lambda rng, s: gen.scalar_array(rng, 20000 * s), EQUAL_RATE),
+    'scalar_array/different': _pair(lambda rng, s: gen.scalar_array(rng, 20000 * s), DIFFERENT_RATE),
+    'record_array/equal': _pair(lambda rng, s: gen.record_array(rng, 300 * s), EQUAL_RATE),
+    'record_array/different': _pair(lambda rng, s: gen.record_array(rng, 300 * s), DIFFERENT_RATE),
+}
+
+STAGES = ('diff', 'json_formatter', 'yaml_formatter', 'cli')
+
+def _measure(fn, repeat):
+    """ Return the best time of repeat calls of fn and the peak memory of another call """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return { 'time': best, 'peak_memory': peak }
+
+# Runs the command in its arguments and prints its wall time, exit code and
+# maximum resident set size. A child process inherits the resident set size
+# high-water mark of the process that started it, so the CLI is started from
+# this small process rather than from the benchmark holding the documents.
+_LAUNCHER = """
+import os, subprocess, sys, time
+start = time.perf_counter()
+with open(os.devnull, 'w') as devnull:
+    proc = subprocess.Popen(sys.argv[1:], stdout=devnull)
+    _, status, usage = os.wait4(proc.pid, 0)
+print(time.perf_counter() - start, os.waitstatus_to_exitcode(status), usage.ru_maxrss)
+"""
+
+def _measure_cli(old_path, new_path, repeat):
+    """ Return the best wall time and the maximum resident set size of the CLI """
+    cmd = [sys.executable, '-m', 'struct_diff', old_path, new_path]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    best = None
+    peak = None
+    for _ in range(repeat):
+        if hasattr(os, 'wait4'):
+            out = subprocess.run([sys.executable, '-c', _LAUNCHER] + cmd, env=env,
+                capture_output=True, text=True, check=True).stdout.split()
+            elapsed, code = float(out[0]), int(out[1])
+            # kilobytes on Linux
+            peak = max(peak or 0, int(out[2]) * 1024)
+        else:
+            start = time.perf_counter()
+            code = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL).returncode
+            elapsed = time.perf_counter() - start
+        if code not in (0, 1):
+            raise RuntimeError(f'{" ".join(cmd)} failed with exit code {code}')
+        best = elapsed if best is None else min(best, elapsed)
+    return { 'time': best, 'peak_memory': peak }
+
+def run_case(name, seed, scale, repeat, stages, workdir):
+    old, new = CASES[name](random.Random(seed), scale)
+    result = {}
+    if 'diff' in stages:
+        result['diff'] = _measure(lambda: diff(old, new), repeat)
+    d = diff(old, new)
+    if 'json_formatter' in stages:
+        result['json_formatter'] = _measure(lambda: JSONFormatter(d).stringify(), repeat)
+    if 'yaml_formatter' in stages:
+        result['yaml_formatter'] = _measure(lambda: YAMLFormatter(d).stringify(), repeat)
+    if 'cli' in stages:
+        old_path = os.path.join(workdir, 'old.json')
+        new_path = os.path.join(workdir, 'new.json')
+        with open(old_path, 'w') as f:
+            json.dump(old, f)
+        with open(new_path, 'w') as f:
+            json.dump(new, f)
+        result['cli'] = _measure_cli(old_path, new_path, repeat)
+    return result
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _format_memory(n):
+    return '-' if n is None else f'{n / 2**20:.1f}MB'
+
+def cmd_run(args):
+    cases = args.case or list(CASES)
+    for name in cases:
+        if name not in CASES:
+            sys.exit(f'unknown case {name}, expected one of {", ".join(CASES)}')
+    stages = args.stage or STAGES
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in cases:
+            results[name] = run_case(name, args.seed, args.scale, args.repeat, stages, workdir)
+            for stage, m in results[name].items():
+                print(f'{name:28} {stage:16} {m["time"]:9.4f}s {_format_memory(m["peak_memory"]):>10}', file=sys.stderr)
+
+    report = {
+        'meta': {
+            'struct_diff': struct_diff.__version__,
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'scale': args.scale,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    for key in ('seed', 'scale'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f'warning: results were produced with different {key}', file=sys.stderr)
+
+    regressions = 0
+    print(f'{"case":28} {"stage":16} {"time":>9} {"memory":>9}')
+    for name, stages in current['results'].items():
+        for stage, m in stages.items():
+            base = baseline['results'].get(name, {}).get(stage)
+            if base is None:
+                continue
+            ratios = []
+            for metric in ('time', 'peak_memory'):
+                if base.get(metric) and m.get(metric) is not None:
+                    ratio = m[metric] / base[metric]
+                    ratios.append(f'{ratio:8.2f}x')
+                    if ratio > 1 + args.threshold:
+                        regressions += 1
+                else:
+                    ratios.append(f'{"-":>9}')
+            print(f'{name:28} {stage:16} {ratios[0]} {ratios[1]}')
+
+    if regressions:
+        print(f'{regressions} measurements regressed by more than {args.threshold:.0%}', file=sys.stderr)
+        return 1
+    return 0
+
+def main(argv=None):
+    # documents of the nested cases are saved for the CLI by the recursive json module
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), JSON_RECURSION_LIMIT))
+    parser = ArgumentParser(prog='run.py', description='struct_diff benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run benchmarks and print or save the results as JSON')
+    run.add_argument('-c', '--case', action='append', help=f'run only this case, can be repeated: {", ".join(CASES)}')
+    run.add_argument('-s', '--stage', action='append', choices=STAGES, help='measure only this stage, can be repeated')
+    run.add_argument('--seed', type=int, default=1, help='seed of the document generators')
+    run.add_argument('--scale', type=int, default=1, help='multiplies the size of generated documents')
+    run.add_argument('-r', '--repeat', type=int, default=3, help='number of timed runs, the best one is reported')
+    run.add_argument('-o', '--output', metavar='FILE', help='write results to FILE instead of stdout')
+    run.set_defaults(func=cmd_run)
+
+    compare = commands.add_parser('compare', help='compare results of two runs, exits with 1 on regressions')
+    compare.add_argument('baseline', help='results of the reference run')
+    compare.add_argument('current', help='results of the run to check')
+    compare.add_argument('-t', '--threshold', type=float, default=0.1, help='ratio of allowed slowdown or memory growth, 0.1 by default')
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,5 +10,11 @@ __copyright__ = """
 """
 __credits__ = ["Andrey Tarantsov", "Mario Hros"]
 
-from .comparator import Comparator, diff
+from .comparator import Comparator, diff, equal, summary
+from .options import Options
+from .delta import Delta, ObjectDelta, ArrayDelta, RangeDelta, Modify, Add, Remove, Move, Unchanged, ELIDED, to_dict
 from .formatters import *
+from .patch import patch, unpatch, PatchError
+from .baseline import Baseline
+from .stats import Stats
+from .summary import Summary
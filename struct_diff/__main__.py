@@ -4,13 +4,74 @@ import json
 import sys
 from argparse import ArgumentParser
 
-from .comparator import diff
-from .formatters import colorize, YAMLFormatter
+from .comparator import Comparator, SEQUENCE_ENGINES, _compare
+from .formatters import JSONFormatter, YAMLFormatter
+from .stream import StreamComparator, StreamError, iter_stream_lines, iter_stream_json
+from .lazy import load_pair
+from .records import RecordComparator
+from .server import SERVER_WORKERS, serve, check_address
+from .batch import BatchError, pairs_from_dirs, pairs_from_manifest, run_batch, write_diff, warn_approximated, print_stats
+
+# Comparing and formatting work at any depth, but the json module parses and
+# encodes recursively. Its recursion limit is raised to this depth, which is still
+# far from exhausting the C stack.
+JSON_RECURSION_LIMIT = 20000
+
+def stream_diff(args, old_file, new_file):
+    """
+    Print the diff of two documents parsed incrementally as it is produced.
+    Returns the exit code or None if the documents cannot be compared as a stream.
+    """
+    comparator = StreamComparator(args)
+    try:
+        entries = comparator.diff(old_file, new_file)
+    except StreamError:
+        return None
+    return write_entries(args, comparator, entries, 'JSON stream')
+
+def records_diff(args, old_file, new_file):
+    """ Print the diff of two NDJSON files as it is produced, returns the exit code """
+    comparator = RecordComparator(args)
+    return write_entries(args, comparator, comparator.diff(old_file, new_file), 'NDJSON')
+
+def write_entries(args, comparator, entries, kind):
+    """ Print entries of a StreamComparator as they are produced, returns the exit code """
+    formatter_stats = None
+    if args.raw_json:
+        chunks = iter_stream_json(comparator, entries)
+    else:
+        formatter = YAMLFormatter(None, args) if args.yaml else JSONFormatter(None, args)
+        formatter_stats = formatter.stats
+        chunks = (line + '\n' for line in iter_stream_lines(comparator, entries, formatter))
+
+    try:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+    except ValueError as e:
+        sys.stdout.flush()
+        print(f"error parsing files {args.old} and {args.new} as {kind}: {e}", file=sys.stderr)
+        return 2
+
+    warn_approximated(comparator.approximated)
+    if args.stats:
+        print_stats(comparator.stats, formatter_stats)
+    return 0 if comparator.equal else 1
+
+def mapped_load(args):
+    """
+    Load both documents lazily from memory mapped files.
+    Returns None if they cannot be loaded this way.
+    """
+    try:
+        with open(args.old, 'rb') as old_file, open(args.new, 'rb') as new_file:
+            return load_pair(old_file, new_file, args)
+    except ValueError:
+        return None
 
 def main(argv=None):
     parser = ArgumentParser(prog='struct_diff')
-    parser.add_argument('old', help='original file')
-    parser.add_argument('new', help='new file')
+    parser.add_argument('old', nargs='?', help='original file')
+    parser.add_argument('new', nargs='?', help='new file')
     parser.add_argument('-C', dest='color', default=None, action='store_true', help='force colorize the output')
     parser.add_argument('--no-color', action='store_true', help='do not colorize the output')
     parser.add_argument('-j', '--raw-json', action='store_true', help='display raw JSON encoding of the diff')
@@ -20,46 +81,166 @@ def main(argv=None):
     parser.add_argument('-o', '--output-keys', metavar='KEY', nargs='+', help='always print this comma separated keys, with their value, if they are part of an object with any diff')
     parser.add_argument('-n', '--output-new-only', action='store_true', help='output only the updated and new key/value pairs (without marking them as such). If you need only the diffs from the old file, just exchange the first and second json')
     parser.add_argument('-s', '--sort', action='store_true', help='sort primitive values in arrays before comparing')
+    parser.add_argument('-u', '--unordered', action='store_true', help='compare all arrays as multisets, ignoring the order of their elements; elements without an equal one in the other array are removed or added')
+    parser.add_argument('--unordered-path', dest='unordered_paths', metavar='PATH', action='append', help='compare only arrays matching this path pattern (e.g. "tags" or "**.hosts") as multisets, like --unordered; can be repeated')
+    parser.add_argument('--numeric-arrays', action='store_true', help='compare arrays of numbers and matrices of them by position in bulk and output changed ranges of elements')
+    parser.add_argument('--abs-tolerance', metavar='X', type=float, help='numbers in arrays of numbers differing by at most X are equal, implies --numeric-arrays')
+    parser.add_argument('--rel-tolerance', metavar='X', type=float, help='numbers in arrays of numbers differing by at most X times the larger magnitude are equal, implies --numeric-arrays')
     parser.add_argument('-c', '--object-context', action='store_true', help='if a scalar value of an object key is changed, also include other (unchanged) values of that object')
     parser.add_argument('-k', '--keys-only', action='store_true', help='compare only the keys, ignore the differences in values')
     parser.add_argument('-K', '--keep-unchanged-values', action='store_true', help='instead of omitting values that are equal, output them as they are')
     parser.add_argument('-p', '--precision', metavar='DECIMALS', type=int, help='round all floating point numbers to this number of decimal places prior to comparison')
+    parser.add_argument('-H', '--structural-hash', action='store_true', help='hash all subtrees of both documents first to skip identical ones and align identical objects in arrays')
+    parser.add_argument('-a', '--array-key', metavar='[PATH=]KEY[,KEY]', action='append', help='align objects in arrays by the values of these comma separated keys instead of fuzzy matching, reordered objects are output as moved (lines starting with >); with PATH= only arrays matching the path pattern (e.g. "servers" or "**.disks") use these keys, an empty KEY disables key alignment there; can be repeated')
+    parser.add_argument('--ignore', metavar='PATH', action='append', help='do not compare values at paths matching this pattern (e.g. "metadata", "**.updated_at" or "items[].id*"); * matches within a key, ** any number of keys and array levels, [] array elements; can be repeated')
+    parser.add_argument('--only', metavar='PATH', action='append', help='compare only values at paths matching this pattern, like --ignore, and the objects and arrays containing them; can be repeated')
+    parser.add_argument('--sequence-engine', choices=list(SEQUENCE_ENGINES), default='auto', help='algorithm aligning array elements; auto uses difflib for short arrays and patience diff for long ones')
+    parser.add_argument('--stream', action='store_true', help='parse both JSON files incrementally and output the diff of top-level object members or array elements as they are read, to compare files larger than memory; array elements are compared by position')
+    parser.add_argument('--mmap', action='store_true', help='memory map both files and parse only object members whose bytes differ; identical members are not parsed nor validated')
+    parser.add_argument('--ndjson', action='store_true', help='both files contain one JSON record per line, read them line by line and output the diff of records as it is found')
+    parser.add_argument('--record-key', metavar='KEY[,KEY]', help='with --ndjson, align records by the values of these comma separated keys instead of by position')
+    parser.add_argument('--record-window', metavar='N', type=int, help='with --ndjson and --record-key, number of records waiting for a match held in memory before the rest of the files is partitioned into temporary files by key')
+    parser.add_argument('--jobs', metavar='N', type=int, default=1, help='compare large top-level object members in N worker processes, 0 uses one per CPU')
+    parser.add_argument('--parallel-threshold', metavar='NODES', type=int, default=10000, help='compare a top-level member in a worker process only if both of its versions together have at least this many values')
+    parser.add_argument('--time-budget', metavar='SECONDS', type=float, help='once comparing takes this long, compare remaining arrays by position instead of aligning their elements and report them as approximated')
+    parser.add_argument('--op-budget', metavar='N', type=int, help='like --time-budget, but after N comparisons of objects or arrays')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print nothing, only exit with 1 if the documents differ and 0 if not, stopping at the first difference')
+    parser.add_argument('--stat', dest='summary', action='store_true', help='instead of the diff, print the number of added, removed and modified values under each top-level key')
+    parser.add_argument('--stat-depth', dest='summary_depth', metavar='N', type=int, default=1, help='with --stat, count changes under the first N components of their path')
+    parser.add_argument('--stats', action='store_true', help='print counts and cumulative times of object and array comparisons, fuzzy match candidates, sequence alignments and output lines by path to stderr')
+    parser.add_argument('--stats-depth', metavar='N', type=int, default=1, help='with --stats, group counts by the first N components of the path')
+    parser.add_argument('--batch', action='store_true', help='old and new are directories, compare files with the same relative path in --jobs worker processes and print a summary')
+    parser.add_argument('--manifest', metavar='FILE', help='compare pairs of files listed in FILE, one old and new path separated by a tab per line, like --batch')
+    parser.add_argument('--output-dir', metavar='DIR', help='with --batch or --manifest, write the diff of each different pair to a .diff file in DIR instead of printing it')
+    parser.add_argument('--serve', metavar='ADDRESS', help='run a server answering diff requests, one JSON object per line, on a Unix socket at this path or on [HOST:]PORT of localhost or another loopback host, keeping parsed documents and baselines between requests')
+    parser.add_argument('--workers', metavar='N', type=int, default=SERVER_WORKERS, help=f'with --serve, number of threads serving requests (default {SERVER_WORKERS})')
     parser.add_argument('-w', '--indent-width', default=None, type=int, help='number of spaces for indendation')
 
     sys_args = argv if argv is not None else sys.argv[:]
     args = parser.parse_args()
 
+    array_keys, args.array_key, args.array_key_paths = args.array_key or [], None, {}
+    for spec in array_keys:
+        path, sep, keys = spec.rpartition('=')
+        if sep:
+            args.array_key_paths[path] = keys
+        else:
+            args.array_key = keys
+
+    if args.jobs < 0:
+        parser.error('--jobs must not be negative')
+    if (args.abs_tolerance or 0) < 0 or (args.rel_tolerance or 0) < 0:
+        parser.error('--abs-tolerance and --rel-tolerance must not be negative')
+
+    batch = args.batch or args.manifest is not None
+    if args.serve is not None:
+        if args.old is not None or batch:
+            parser.error('--serve cannot be used with old and new files, --batch or --manifest')
+        if args.workers < 1:
+            parser.error('--workers must be positive')
+    if args.serve is None and args.manifest is None and (args.old is None or args.new is None):
+        parser.error('the following arguments are required: old, new')
+    if args.manifest is not None and (args.batch or args.old is not None):
+        parser.error('--manifest cannot be used with --batch or old and new files')
+    if args.output_dir and not batch:
+        parser.error('--output-dir can only be used with --batch or --manifest')
+    if args.stream and batch:
+        parser.error('--stream cannot be used with --batch or --manifest')
+    if args.mmap and (args.stream or batch):
+        parser.error('--mmap cannot be used with --stream, --batch or --manifest')
+    if args.ndjson and (args.stream or args.mmap or batch):
+        parser.error('--ndjson cannot be used with --stream, --mmap, --batch or --manifest')
+    if (args.record_key or args.record_window is not None) and not args.ndjson:
+        parser.error('--record-key and --record-window can only be used with --ndjson')
+    if args.record_window is not None and args.record_window < 1:
+        parser.error('--record-window must be positive')
+    if (args.quiet or args.summary) and (args.stream or args.ndjson or batch):
+        parser.error('--quiet and --stat cannot be used with --stream, --ndjson, --batch or --manifest')
+    if args.quiet and args.summary:
+        parser.error('--quiet cannot be used with --stat')
+    if args.stats and batch:
+        parser.error('--stats cannot be used with --batch or --manifest')
+
+    if args.stream and args.object_context:
+        parser.error('--object-context cannot be used with --stream')
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), JSON_RECURSION_LIMIT))
+
+    if args.serve is not None:
+        try:
+            check_address(args.serve)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f'serving on {args.serve}', file=sys.stderr)
+        serve(args.serve, args.workers)
+        return 0
+
     if args.no_color:
         args.color = False
     else:
         if args.color is None:
             args.color = sys.stdout.isatty()
 
-    with open(args.old) as old_file, open(args.new) as new_file:
+    if batch:
         try:
-            obj1 = json.load(old_file)
-        except Exception as e:
-            print(f"error parsing file {args.old} as JSON: {e}", file=sys.stderr)
+            if args.manifest is not None:
+                with open(args.manifest) as manifest:
+                    pairs = pairs_from_manifest(manifest)
+            else:
+                pairs = pairs_from_dirs(args.old, args.new)
+        except (OSError, BatchError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        return run_batch(args, pairs)
+
+    objs = mapped_load(args) if args.mmap else None
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        if args.ndjson:
+            return records_diff(args, old_file, new_file)
+
+        if args.stream:
+            code = stream_diff(args, old_file, new_file)
+            if code is not None:
+                return code
             old_file.seek(0, 0)
-            obj1 = old_file.read()
-        
-        try:
-            obj2 = json.load(new_file)
-        except Exception as e:
-            print(f"error parsing file {args.old} as JSON: {e}", file=sys.stderr)
             new_file.seek(0, 0)
-            obj2 = new_file.read()
 
-        diff_res = diff(obj1, obj2, args)
-
-        if args.yaml:
-            outs = str(YAMLFormatter(diff_res, args))
-        elif args.raw_json:
-            outs = json.dumps(diff_res, indent=2, ensure_ascii=False)
+        if objs is not None:
+            obj1, obj2 = objs
         else:
-            outs = str(colorize(diff_res, args))
+            try:
+                obj1 = json.load(old_file)
+            except Exception as e:
+                print(f"error parsing file {args.old} as JSON: {e}", file=sys.stderr)
+                old_file.seek(0, 0)
+                obj1 = old_file.read()
+            
+            try:
+                obj2 = json.load(new_file)
+            except Exception as e:
+                print(f"error parsing file {args.old} as JSON: {e}", file=sys.stderr)
+                new_file.seek(0, 0)
+                obj2 = new_file.read()
+
+        comparator = Comparator(args)
+        if args.quiet:
+            return 0 if comparator.equal(obj1, obj2) else 1
+        if args.summary:
+            summary = comparator.summary(obj1, obj2)
+            warn_approximated(comparator.approximated)
+            if summary:
+                print(summary.format())
+            if args.stats:
+                print_stats(comparator.stats)
+            return 1 if summary else 0
+
+        diff_res = _compare(comparator, obj1, obj2)
+        warn_approximated(comparator.approximated)
 
-        print(outs, end=None if len(outs)>0 else '')
+        formatter_stats = write_diff(diff_res, args, sys.stdout)
+        if args.stats:
+            print_stats(comparator.stats, formatter_stats)
 
     # return 1 if there were differences
     if diff_res is not None and len(diff_res) > 0:
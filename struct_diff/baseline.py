@@ -0,0 +1,113 @@
+"""
+Repeated comparison of new documents against the same baseline document.
+
+A Baseline indexes the old document once, so every comparison only pays
+for walking the new document. The index can be saved to a file.
+"""
+
+import pickle
+
+from .comparator import Comparator
+from .options import Options
+
+# hash of a string, differs between processes unless PYTHONHASHSEED is set
+_HASH_PROBE = 'struct_diff'
+
+class Baseline(object):
+    """
+    Old document indexed for repeated comparisons. Scalarized sequences of all
+    its arrays and, with the structural_hash option, hashes of all its
+    subtrees are computed once and reused by every diff().
+
+    The document must not be modified while the baseline is in use.
+    """
+
+    def __init__(self, obj, opts=None):
+        self.options = Options.of(opts)
+        self.obj = obj
+        self._index()
+
+    def _index(self):
+        comparator = Comparator(self.options)
+        if comparator._hashes is not None:
+            comparator._hash(self.obj)
+        self._hashes = comparator._hashes
+        self._sequences = {}
+        self._index_arrays(comparator)
+        self._hash_probe = hash(_HASH_PROBE)
+
+    def _index_arrays(self, comparator):
+        path = comparator._path
+        # objects and arrays with the length of the path of their parent and their key
+        stack = [(self.obj, 0, None)]
+        while stack:
+            value, depth, key = stack.pop()
+            del path[depth:]
+            if key is not None:
+                path.append(key)
+            if isinstance(value, dict):
+                stack.extend((item, len(path), key) for key, item in value.items() if isinstance(item, (dict, list)))
+            elif isinstance(value, list):
+                key_fields = comparator._array_key_fields()
+                path.append('[]')
+                for fields in ((key_fields, ()) if key_fields else ((),)):
+                    seq, originals = comparator._scalarize_old(value, fields)
+                    if seq is not None:
+                        self._sequences[(id(value), fields)] = (value, seq, originals)
+                stack.extend((item, len(path), None) for item in value if isinstance(item, (dict, list)))
+        del path[:]
+
+    def comparator(self):
+        """ Return a new Comparator using the index of the baseline """
+        comparator = Comparator(self.options)
+        comparator._sequences = self._sequences
+        # hashes of the new document are added to a copy for every comparison
+        comparator._baseline_hashes = self._hashes
+        return comparator
+
+    def diff(self, obj):
+        """ Compare the baseline with a new document and return the differences like diff() """
+        return self.comparator().diff(self.obj, obj)['result']
+
+    def save(self, file):
+        """ Save the baseline and its index to a binary file object or a path """
+        if isinstance(file, str):
+            with open(file, 'wb') as f:
+                return self.save(f)
+        # ids are not preserved, the index is stored by object and rebuilt by load()
+        state = {
+            'options': self.options.replace(theme=None),
+            'obj': self.obj,
+            'hashes': list(self._hashes.values()) if self._hashes is not None else None,
+            'sequences': [(fields,) + entry for (_, fields), entry in self._sequences.items()],
+            'hash_probe': self._hash_probe,
+        }
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a baseline saved by save() from a binary file object or a path.
+        Uses pickle, so load only files you trust.
+        """
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                return cls.load(f)
+        state = pickle.load(file)
+        baseline = cls.__new__(cls)
+        baseline.options = state['options']
+        baseline.obj = state['obj']
+        if state['hash_probe'] != hash(_HASH_PROBE):
+            # string hashes are salted per process, so the
+            # structural hashes and keys derived from them changed
+            baseline._index()
+            return baseline
+        baseline._hash_probe = state['hash_probe']
+        baseline._hashes = None
+        if state['hashes'] is not None:
+            baseline._hashes = { id(obj): (obj, h) for obj, h in state['hashes'] }
+        baseline._sequences = {
+            (id(array), fields): (array, seq, originals)
+            for fields, array, seq, originals in state['sequences']
+        }
+        return baseline
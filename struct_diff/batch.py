@@ -0,0 +1,203 @@
+"""
+Batch comparison of many pairs of JSON files in one process.
+
+Pairs are matched by relative path in two directory trees or read from
+a manifest file and compared by a pool of worker processes, so the interpreter
+startup and import cost is paid once per worker instead of once per pair.
+"""
+
+import io
+import json
+import os
+import sys
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+
+from .comparator import Comparator, _compare
+from .formatters import JSONFormatter, YAMLFormatter
+from .stats import Stats
+
+# pairs sent to a worker process at once
+BATCH_CHUNK_SIZE = 16
+
+class BatchError(ValueError):
+    pass
+
+def write_diff(diff_res, args, stream):
+    """
+    Write a diff in the output format selected by the command line arguments.
+    Returns the stats of the formatter, None for raw JSON or without the stats option.
+    """
+    if args.raw_json and not args.yaml:
+        json.dump(diff_res, stream, indent=2, ensure_ascii=False)
+        stream.write('\n')
+        return None
+    formatter = YAMLFormatter(diff_res, args) if args.yaml else JSONFormatter(diff_res, args)
+    formatter.write_to(stream)
+    return formatter.stats
+
+def print_stats(*stats):
+    """ Print the merged counts and times of comparing and formatting to stderr """
+    merged = Stats()
+    for s in stats:
+        if s is not None:
+            merged.merge(s)
+    print(merged.format(), file=sys.stderr)
+
+def warn_approximated(approximated, name=None):
+    """ Print a warning listing paths compared approximately because the budget was exhausted """
+    if approximated:
+        where = f' in {name}' if name else ''
+        paths = ', '.join(path or '(root)' for path in approximated)
+        print(f'warning: comparison budget exhausted, compared approximately{where}: {paths}', file=sys.stderr)
+
+def _list_files(root):
+    files = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            files.add(os.path.relpath(os.path.join(dirpath, name), root))
+    return files
+
+def pairs_from_dirs(old_dir, new_dir):
+    """
+    Match files of two directory trees by relative path. Returns sorted
+    (name, old_path, new_path) tuples, the path of a file missing
+    from one of the trees is None.
+    """
+    for path in (old_dir, new_dir):
+        if not os.path.isdir(path):
+            raise BatchError(f'{path} is not a directory')
+    old_files = _list_files(old_dir)
+    new_files = _list_files(new_dir)
+    return [
+        (name,
+         os.path.join(old_dir, name) if name in old_files else None,
+         os.path.join(new_dir, name) if name in new_files else None)
+        for name in sorted(old_files | new_files)
+    ]
+
+def pairs_from_manifest(manifest):
+    """
+    Read (name, old_path, new_path) tuples from a text file with an old and a new
+    path separated by a tab on each line. Empty lines and lines starting with # are
+    skipped. The new path is used as the name of the pair.
+    """
+    pairs = []
+    for lineno, line in enumerate(manifest, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        paths = line.split('\t')
+        if len(paths) != 2:
+            raise BatchError(f'{getattr(manifest, "name", "manifest")}:{lineno}: expected old and new path separated by a tab')
+        pairs.append((paths[1], paths[0], paths[1]))
+    return pairs
+
+def _diff_pair(args, pair):
+    """
+    Compare a pair of files in a worker process. Returns (name, status, text, approximated)
+    where status is 0 for equal files, 1 for different and 2 for errors.
+    """
+    name, old_path, new_path = pair
+    try:
+        with open(old_path) as old_file:
+            obj1 = json.load(old_file)
+        with open(new_path) as new_file:
+            obj2 = json.load(new_file)
+        comparator = Comparator(args)
+        diff_res = _compare(comparator, obj1, obj2)
+    except Exception as e:
+        return name, 2, f'{type(e).__name__}: {e}', []
+
+    if diff_res is None or len(diff_res) == 0:
+        return name, 0, '', comparator.approximated
+    out = io.StringIO()
+    write_diff(diff_res, args, out)
+    return name, 1, out.getvalue(), comparator.approximated
+
+def _diff_pairs(args, pairs):
+    """ Compare pairs present in both trees in order, in worker processes if requested """
+    jobs = args.jobs or os.cpu_count() or 1
+    # the pool is already parallel, documents are compared sequentially
+    worker_args = Namespace(**vars(args))
+    worker_args.jobs = 1
+
+    if jobs == 1 or len(pairs) < 2:
+        for pair in pairs:
+            yield _diff_pair(worker_args, pair)
+        return
+
+    with ProcessPoolExecutor(min(jobs, len(pairs))) as pool:
+        yield from pool.map(_diff_pair, [worker_args] * len(pairs), pairs, chunksize=BATCH_CHUNK_SIZE)
+
+def _output_path(output_dir, name):
+    """
+    Return the path of the diff file of a pair in output_dir. Absolute names are
+    placed below output_dir, names resolving outside of it raise BatchError.
+    """
+    path = os.path.join(output_dir, os.path.normpath(name).lstrip(os.sep) + '.diff')
+    root = os.path.realpath(output_dir)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise BatchError(f'diff of {name} would be written outside of {output_dir}')
+    return path
+
+def run_batch(args, pairs, out=None):
+    """
+    Compare (name, old_path, new_path) pairs and write the diff of every different pair
+    to out, or to a file in args.output_dir, followed by a summary. Returns the exit code:
+    0 if all pairs are equal, 1 if any differ and 2 if any pair could not be compared.
+    """
+    out = out or sys.stdout
+    output_dir = getattr(args, 'output_dir', None)
+    if output_dir:
+        args = Namespace(**vars(args))
+        args.color = False
+
+    counts = { 'equal': 0, 'different': 0, 'only_old': 0, 'only_new': 0, 'errors': 0 }
+    compared = [pair for pair in pairs if pair[1] is not None and pair[2] is not None]
+    results = _diff_pairs(args, compared)
+
+    for name, old_path, new_path in pairs:
+        if new_path is None:
+            counts['only_old'] += 1
+            out.write(f'Only in old: {name}\n')
+            continue
+        if old_path is None:
+            counts['only_new'] += 1
+            out.write(f'Only in new: {name}\n')
+            continue
+
+        name, status, text, approximated = next(results)
+        warn_approximated(approximated, name)
+        if status == 0:
+            counts['equal'] += 1
+        elif status == 2:
+            counts['errors'] += 1
+            print(f'error comparing {old_path} and {new_path}: {text}', file=sys.stderr)
+        elif output_dir:
+            try:
+                path = _output_path(output_dir, name)
+            except BatchError as e:
+                counts['errors'] += 1
+                print(f'error: {e}', file=sys.stderr)
+                continue
+            counts['different'] += 1
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(text)
+            out.write(f'Different: {name}\n')
+        else:
+            counts['different'] += 1
+            out.write(f'struct_diff {old_path} {new_path}\n')
+            out.write(text)
+    results.close()
+
+    out.write(f'{len(pairs)} files: {counts["equal"]} equal, {counts["different"]} different, '
+              f'{counts["only_old"]} only in old, {counts["only_new"]} only in new, '
+              f'{counts["errors"]} errors\n')
+
+    if counts['errors']:
+        return 2
+    if counts['different'] or counts['only_old'] or counts['only_new']:
+        return 1
+    return 0
@@ -1,126 +1,661 @@
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
 from difflib import SequenceMatcher
 import json
+import math
+import os
+import time
 from enum import Enum
 
-from .util import _extend_typeof, _round_obj, _get_opt
-
-class OP:
-    NONE = ' '
-    ADD = '+'
-    REMOVE = '-'
-    MODIFY = '~'
+from .options import Options
+from .stats import Stats
+from .summary import Summary, ADDED, REMOVED, MODIFIED
+from .delta import Delta, Modify, Add, Remove, Move, Unchanged, ELIDED, ObjectDelta, ArrayDelta, RangeDelta
+from .util import OP, _is_ranges, _extend_typeof, _round_scalar, _get_opt, _LRUCache, _format_path, _count_nodes, _equal
 
 class ParserError(ValueError):
     pass
 
+DEFAULT_CACHE_SIZE = 65536
+
+def _opcodes_from_blocks(blocks, n, m):
+    """
+    Convert sorted matching blocks (i, j, size) of two sequences of lengths n and m
+    to a list of (tag, i1, i2, j1, j2) opcodes like SequenceMatcher.get_opcodes()
+    """
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in blocks + [(n, m, 0)]:
+        if i < ai and j < bj:
+            opcodes.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(('delete', i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(('insert', i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            if opcodes and opcodes[-1][0] == 'equal':
+                # join adjacent blocks
+                opcodes[-1] = ('equal', opcodes[-1][1], i, opcodes[-1][3], j)
+            else:
+                opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
+
+def _trim_common(a, b, alo, ahi, blo, bhi, blocks):
+    """ Record the common prefix and suffix of two ranges as matching blocks and return the rest """
+    start = alo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    if alo > start:
+        blocks.append((start, blo - (alo - start), alo - start))
+    end = ahi
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+    if ahi < end:
+        blocks.append((ahi, bhi, end - ahi))
+    return alo, ahi, blo, bhi
+
+def _myers_blocks(a, b, alo, ahi, blo, bhi, blocks, max_d=None):
+    """
+    Append matching blocks of a minimal edit script of a[alo:ahi] and b[blo:bhi]
+    found by the O(ND) Myers algorithm. Returns False without appending anything
+    if the edit distance exceeds max_d.
+    """
+    alo, ahi, blo, bhi = _trim_common(a, b, alo, ahi, blo, bhi, blocks)
+    n, m = ahi - alo, bhi - blo
+    if n == 0 or m == 0:
+        return True
+    limit = n + m if max_d is None else min(n + m, max_d)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+    for d in range(0, limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            trace.append(v[offset - d:offset + d + 1])
+            continue
+        break
+    else:
+        return False
+
+    # walk the trace back from the end, collecting diagonals (snakes)
+    found = []
+    x, y = n, m
+    for d in range(d, 0, -1):
+        k = x - y
+        prev = trace[d - 1]
+        if k == -d or (k != d and prev[k - 1 + d - 1] < prev[k + 1 + d - 1]):
+            prev_k = k + 1
+            prev_x = prev[prev_k + d - 1]
+            mid_x = prev_x
+        else:
+            prev_k = k - 1
+            prev_x = prev[prev_k + d - 1]
+            mid_x = prev_x + 1
+        if x > mid_x:
+            found.append((alo + mid_x, blo + mid_x - k, x - mid_x))
+        x, y = prev_x, prev_x - prev_k
+    if x > 0:
+        found.append((alo, blo, x))
+    blocks.extend(found)
+    return True
+
+def _patience_blocks(a, b, alo, ahi, blo, bhi, blocks):
+    """
+    Append matching blocks of a[alo:ahi] and b[blo:bhi] found by patience diff:
+    elements occurring exactly once in both ranges are matched by their longest
+    increasing subsequence and the gaps between them are diffed recursively.
+    Gaps without unique elements are diffed by Myers, falling back to SequenceMatcher
+    when their edit distance makes Myers too slow.
+    """
+    regions = [(alo, ahi, blo, bhi)]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        alo, ahi, blo, bhi = _trim_common(a, b, alo, ahi, blo, bhi, blocks)
+        if alo == ahi or blo == bhi:
+            continue
+
+        counts = {}
+        for i in range(alo, ahi):
+            item = a[i]
+            counts[item] = -1 if item in counts else i
+        unique = {}
+        for j in range(blo, bhi):
+            item = b[j]
+            i = counts.get(item, -1)
+            if i >= 0:
+                unique[item] = -1 if item in unique else j
+        pairs = sorted((counts[item], j) for item, j in unique.items() if j >= 0)
+
+        if not pairs:
+            if not _myers_blocks(a, b, alo, ahi, blo, bhi, blocks, max_d=PATIENCE_MAX_MYERS_D):
+                for ai, bj, size in SequenceMatcher(None, a[alo:ahi], b[blo:bhi]).get_matching_blocks():
+                    if size:
+                        blocks.append((alo + ai, blo + bj, size))
+            continue
+
+        # longest increasing subsequence of j over pairs sorted by i
+        anchors = [pairs[n] for n in _increasing_subsequence([j for i, j in pairs])]
+
+        prev_i, prev_j = alo, blo
+        for i, j in anchors:
+            regions.append((prev_i, i, prev_j, j))
+            blocks.append((i, j, 1))
+            prev_i, prev_j = i + 1, j + 1
+        regions.append((prev_i, ahi, prev_j, bhi))
+
+def _increasing_subsequence(values):
+    """ Return the indexes of a longest strictly increasing subsequence of values in ascending order """
+    if not values:
+        return []
+    tails = []
+    tail_indexes = []
+    predecessors = []
+    for n, value in enumerate(values):
+        pos = bisect_left(tails, value)
+        if pos == len(tails):
+            tails.append(value)
+            tail_indexes.append(n)
+        else:
+            tails[pos] = value
+            tail_indexes[pos] = n
+        predecessors.append(tail_indexes[pos - 1] if pos > 0 else -1)
+    indexes = []
+    n = tail_indexes[-1]
+    while n >= 0:
+        indexes.append(n)
+        n = predecessors[n]
+    indexes.reverse()
+    return indexes
+
+def _difflib_opcodes(seq1, seq2):
+    return SequenceMatcher(None, seq1, seq2).get_opcodes()
+
+def _myers_opcodes(seq1, seq2):
+    blocks = []
+    _myers_blocks(seq1, seq2, 0, len(seq1), 0, len(seq2), blocks)
+    blocks.sort()
+    return _opcodes_from_blocks(blocks, len(seq1), len(seq2))
+
+def _patience_opcodes(seq1, seq2):
+    blocks = []
+    _patience_blocks(seq1, seq2, 0, len(seq1), 0, len(seq2), blocks)
+    blocks.sort()
+    return _opcodes_from_blocks(blocks, len(seq1), len(seq2))
+
+def _auto_opcodes(seq1, seq2):
+    if len(seq1) + len(seq2) < AUTO_ENGINE_THRESHOLD:
+        return _difflib_opcodes(seq1, seq2)
+    return _patience_opcodes(seq1, seq2)
+
+# sequence diff engines selectable by the sequence_engine option,
+# each returns opcodes in the format of SequenceMatcher.get_opcodes()
+SEQUENCE_ENGINES = {
+    'auto': _auto_opcodes,
+    'difflib': _difflib_opcodes,
+    'myers': _myers_opcodes,
+    'patience': _patience_opcodes,
+}
+# total length of two sequences from which auto engine switches from difflib to patience
+AUTO_ENGINE_THRESHOLD = 200
+# max edit distance of a gap without unique elements which patience diffs by Myers
+PATIENCE_MAX_MYERS_D = 1000
+
+# numeric arrays are compared in slices of this many elements, see _numeric_ranges()
+NUMERIC_SLICE = 256
+
+_NUMBER_TYPES = frozenset((int, float))
+
+def _numeric_kind(array):
+    """
+    Returns 'numbers' for a list of numbers, not booleans, 'matrix' for a non-empty
+    list of such lists or of nested matrices, None for other lists
+    """
+    types = set(map(type, array))
+    if types <= _NUMBER_TYPES:
+        return 'numbers'
+    if types == {list} and all(_numeric_kind(row) is not None for row in array):
+        return 'matrix'
+    return None
+
+def _round_copy(value, precision):
+    """
+    Return a copy of value with floats rounded to precision decimal places.
+    Objects, arrays and Delta nodes are copied, so values shared with
+    the compared documents are not modified.
+    """
+    holder = [value]
+    stack = [holder]
+    while stack:
+        container = stack.pop()
+        if isinstance(container, dict):
+            items = container.items()
+        elif isinstance(container, list):
+            items = enumerate(container)
+        else:
+            items = [(name, getattr(container, name)) for name in container.__slots__]
+        for k, item in items:
+            if isinstance(item, dict):
+                item = dict(item)
+            elif isinstance(item, list):
+                item = list(item)
+            elif isinstance(item, Delta) and item.__slots__:
+                copy = object.__new__(type(item))
+                for name in item.__slots__:
+                    setattr(copy, name, getattr(item, name))
+                item = copy
+            elif isinstance(item, float) and math.isfinite(item):
+                item = round(item, precision)
+            else:
+                continue
+            if not isinstance(item, float):
+                stack.append(item)
+            if isinstance(container, Delta):
+                setattr(container, k, item)
+            else:
+                container[k] = item
+    return holder[0]
+
+def _diff_member(options, key, value1, value2):
+    """ Compare a top-level object member in a worker process, returns the change, approximated paths and stats """
+    comparator = Comparator(options)
+    comparator._path.append(key)
+    return comparator.diff(value1, value2), comparator.approximated, comparator.stats
+
 class Comparator(object):
     def __init__(self, opts=None):
         self.opts = opts
+        self.options = Options.of(opts)
+        o = self.options
+        if o.summary:
+            # changes are counted, so it does not matter how unchanged values would be output
+            # output_new_only is kept, deleted keys are not changes with it
+            o = self.options = o.replace(full=False, keep_unchanged_values=False,
+                                         object_context=False, output_keys=(), typed=False)
+        # memoized results of object/array comparisons keyed by the identity
+        # of both operands; the entries keep references to the operands,
+        # so ids cannot be recycled while they are cached
+        self._cache = _LRUCache(DEFAULT_CACHE_SIZE if o.cache_size is None else o.cache_size)
+        # structural hashes of visited subtrees keyed by id, see _hash();
+        # unordered arrays are compared by the hashes of their elements.
+        # Hashes of a Baseline document are kept, others only for one comparison
+        self._hashes = {} if o.structural_hash or o.unordered or o.unordered_patterns else None
+        self._baseline_hashes = None
+        # path of the value being compared, see _format_path()
+        self._path = []
+        if o.sequence_engine not in SEQUENCE_ENGINES:
+            raise ValueError(f'unknown sequence engine \'{o.sequence_engine}\', expected one of {", ".join(SEQUENCE_ENGINES)}')
+        self._sequence_opcodes = SEQUENCE_ENGINES[o.sequence_engine]
+        # build results from Delta nodes instead of dicts and lists
+        self._typed = o.typed
+        # comparisons may be limited by time or count, see _over_budget()
+        self._budgeted = o.time_budget is not None or o.op_budget is not None
+        # paths of arrays compared approximately, used as an ordered set
+        self._approximated = {}
+        # scalarized arrays of a Baseline document, see _scalarize_old()
+        self._sequences = None
+        # floats are compared rounded to this number of decimal places
+        self._precision = o.precision
+        # numbers are compared within these tolerances in numeric arrays, see _numeric_array_diff()
+        self._abs_tolerance = o.abs_tolerance or 0
+        self._rel_tolerance = o.rel_tolerance or 0
+        if self._abs_tolerance < 0 or self._rel_tolerance < 0:
+            raise ValueError('abs_tolerance and rel_tolerance must not be negative')
+        # sorted arrays and arrays compared by keys only are aligned like any other
+        self._numeric = (o.numeric_arrays or self._abs_tolerance > 0 or self._rel_tolerance > 0) \
+            and not o.sort and not o.keys_only
+        # compiled ignore and only patterns, and their states by path length, see _filter_state()
+        self._path_filter = o.path_filter
+        self._filter_states = []
+        # counts and times of operations with the stats option, see Stats;
+        # the counting variants are bound only when needed, so they cost nothing otherwise
+        self.stats = None
+        if o.stats:
+            self.stats = Stats(o.stats_depth)
+            self._container_diff = self._counted_container_diff
+            self._sequence_opcodes = self._counted_sequence_opcodes
+        self.reset_budget()
 
     def _get_opt(self, key, default=False):
         return _get_opt(self.opts, key, default)
 
+    def reset_budget(self):
+        """ Start counting the time_budget and op_budget from now """
+        self._ops = 0
+        self._exhausted = False
+        t = self.options.time_budget
+        self._deadline = time.monotonic() + t if t is not None else None
+
+    def _over_budget(self):
+        """ Count a comparison against the budget, returns True once it is exhausted """
+        if not self._exhausted:
+            self._ops += 1
+            n = self.options.op_budget
+            if (n is not None and self._ops > n) or \
+                (self._deadline is not None and time.monotonic() > self._deadline):
+                self._exhausted = True
+        return self._exhausted
+
+    def _remaining_budget(self):
+        """ Return time_budget and op_budget options for comparisons continuing the budget elsewhere """
+        o = self.options
+        time_budget = max(0, self._deadline - time.monotonic()) if self._deadline is not None else None
+        op_budget = max(0, o.op_budget - self._ops) if o.op_budget is not None else None
+        return { 'time_budget': time_budget, 'op_budget': op_budget }
+
+    def _approximate(self):
+        """ Record that the array at the current path is compared approximately """
+        self._approximated[_format_path(self._path)] = True
+
+    @property
+    def approximated(self):
+        """
+        Paths of arrays compared approximately because the time_budget or op_budget was
+        exhausted, by position instead of by alignment or with some fuzzy matches skipped
+        """
+        return list(self._approximated)
+
+    def cache_info(self):
+        """ Return hits, misses, size and maxsize of the subtree comparison cache of the last comparison """
+        return self._cache.info()
+
+    def _hash(self, obj):
+        """
+        Return a Merkle-style structural hash of obj.
+        Hashes of all nested objects and arrays are computed along the way
+        and remembered, so every subtree of an input is hashed only once.
+        Subtrees are hashed children first using an explicit stack.
+        """
+        if not isinstance(obj, (dict, list)):
+            return self._scalar_hash(obj)
+        hashes = self._hashes
+        entry = hashes.get(id(obj))
+        if entry is not None:
+            return entry[1]
+
+        stack = [(obj, False)]
+        while stack:
+            value, children_hashed = stack.pop()
+            if not children_hashed:
+                if id(value) in hashes:
+                    continue
+                stack.append((value, True))
+                for child in (value.values() if isinstance(value, dict) else value):
+                    if isinstance(child, (dict, list)) and id(child) not in hashes:
+                        stack.append((child, False))
+                continue
+
+            if isinstance(value, dict):
+                # key order does not matter for object equality
+                h = 0
+                for key, child in value.items():
+                    h ^= hash((key, hashes[id(child)][1] if isinstance(child, (dict, list)) else self._scalar_hash(child)))
+                h = hash(('{}', len(value), h))
+            else:
+                h = hash(('[]',) + tuple(hashes[id(child)][1] if isinstance(child, (dict, list)) else self._scalar_hash(child)
+                                         for child in value))
+            # keep a reference so the id stays valid as long as the entry
+            hashes[id(value)] = (value, h)
+        return hashes[id(obj)][1]
+
+    def _scalar_hash(self, obj):
+        if self._precision is not None:
+            obj = _round_scalar(obj, self._precision)
+        try:
+            return hash(obj)
+        except TypeError:
+            return id(obj)
+
+    def _hash_key(self, obj):
+        """ Scalarized key of an object, shared by all structurally equal objects """
+        return '__$!HASH' + format(self._hash(obj), 'x')
+
+    def _equal_change(self, obj):
+        """ Return the {score, equal, result} dict of obj compared with an equal object """
+        if isinstance(obj, dict):
+            score = 100 * max(len(obj), 0.5)
+            result = dict(obj) if self.options.full else None
+        else:
+            score = 100
+            result = obj if self.options.full else None
+        if result is not None and self._typed:
+            result = Unchanged(obj)
+        return { 'score': score, 'result': result, 'equal': True }
+
     def __is_scalar(self, obj):
         return not isinstance(obj, (list, dict)) or obj is None
 
+    def _submit_members(self, obj1, obj2):
+        """
+        Submit comparisons of members of the root objects with at least
+        parallel_threshold nodes to a process pool, return futures by key
+        """
+        o = self.options
+        threshold = o.parallel_threshold
+        large = []
+        for key, value1 in obj1.items():
+            if key in obj2:
+                value2 = obj2[key]
+                if self.__is_scalar(value1) or type(value1) != type(value2):
+                    continue
+                if self._hashes is not None and self._hash(value1) == self._hash(value2) and _equal(value1, value2, self._precision):
+                    continue
+                if _count_nodes(value1, threshold) + _count_nodes(value2, threshold) >= threshold:
+                    large.append(key)
+        if len(large) < 2:
+            return {}
+
+        # workers compare members only, formatting options may not be picklable
+        options = o.replace(theme=None, jobs=1, **(self._remaining_budget() if self._budgeted else {}))
+        pool = ProcessPoolExecutor(min(o.jobs or os.cpu_count() or 1, len(large)))
+        try:
+            futures = { key: pool.submit(_diff_member, options, key, obj1[key], obj2[key]) for key in large }
+        finally:
+            # submitted comparisons still run, the workers exit when they are done
+            pool.shutdown(wait=False)
+        return futures
+
     def object_diff(self, obj1, obj2):
         """ Compare two dicts and return {score, equal, result} dict """
+        self._start()
+        return self._round_change(self._run(self._object_diff(obj1, obj2)))
+
+    def _object_diff(self, obj1, obj2):
+        o = self.options
+        typed = self._typed
         result = {}
         score = 0
         equal = True
 
         for key, value in obj1.items():
-            if not self._get_opt('output_new_only'):
+            if not o.output_new_only:
                 postfix = '__deleted'
             
                 if key not in obj2:
-                    result[f'{key}{postfix}'] = value
+                    if typed:
+                        result[key] = Remove(value)
+                    else:
+                        result[f'{key}{postfix}'] = value
                     score -= 30
                     equal = False
 
+        postfix = '__added' if not o.output_new_only else ''
         for key, value in obj2.items():
-            postfix = '__added' if not self._get_opt('output_new_only') else ''
 
             if key not in obj1:
-                result[f'{key}{postfix}'] = value
+                if typed:
+                    result[key] = Add(value)
+                else:
+                    result[f'{key}{postfix}'] = value
                 score -= 30
                 equal = False
 
+        # members of the root objects can be compared in parallel
+        futures = self._submit_members(obj1, obj2) if o.jobs != 1 and not self._path else {}
+
         scalars_changed = False
         for key, value1 in obj1.items():
             if key in obj2:
                 score += 20
                 value2 = obj2[key]
-                change = self.diff(value1, value2)
+                if key in futures:
+                    change, approximated, stats = futures.pop(key).result()
+                    self._approximated.update(dict.fromkeys(approximated, True))
+                    if stats is not None:
+                        self.stats.merge(stats)
+                else:
+                    change, node = self._diff_pair(value1, value2)
+                    if node is not None:
+                        self._path.append(key)
+                        change = yield node
+                        self._path.pop()
                 if not change['equal']:
                     result[key] = change['result']
                     equal = False
                     if self.__is_scalar(value2):
                         scalars_changed = True
-                elif self._get_opt('full') or key in self._get_opt('output_keys', []):
-                    result[key] = value1
+                elif o.full or key in o.output_keys:
+                    result[key] = Unchanged(value1) if typed else value1
                     score += min(20, max(-10, change['score'] / 5)) # BATMAN!
 
-        # include sigling keys of an object with diffs
-        if scalars_changed and self._get_opt('object_context'):
+        # include sigling keys of an object with diffs, deleted keys are already included
+        if scalars_changed and o.object_context:
             for key, value1 in obj1.items():
-                if key not in result:
-                    result[key] = value1
+                if key in obj2 and key not in result:
+                    result[key] = Unchanged(value1) if typed else value1
                     score += min(20, max(-10, change['score'] / 5)) # DOUBLE BATMAN!
 
         if equal:
             score = 100 * max(len(obj1), 0.5)
-            if not self._get_opt('full'):
+            if not o.full:
                 result = None
         else:
             score = max(0, score)   
+        if typed and result is not None:
+            result = ObjectDelta(result)
         return { 'score': score, 'result': result, 'equal': equal }
 
     def _find_matching_object(self, item, index, fuzzy_originals):
         best_match = None
+        stats = self.stats
+        if stats is not None:
+            token = stats.start('fuzzy_match', self._path)
+        candidates = 0
 
         for key, it in fuzzy_originals.items():
+            if self._exhausted:
+                self._approximate()
+                break
             if key != '__next':
                 candidate = it['item']
                 match_index = it['index']
                 index_distance = abs(match_index - index)
                 if _extend_typeof(item) == _extend_typeof(candidate):
-                    score = self.diff(item, candidate)['score']
+                    candidates += 1
+                    change, node = self._diff_pair(item, candidate)
+                    if node is not None:
+                        change = yield node
+                    score = change['score']
                     if not best_match or \
                         score > best_match['score'] or \
                         (score == best_match['score'] and
                         index_distance < best_match['index_distance']):
                             best_match = { 'score': score, 'key': key, 'index_distance': index_distance }
 
+        if stats is not None:
+            # counted once per candidate evaluated
+            stats.stop(token, candidates)
         return best_match
 
-    def _scalarize(self, array, originals, fuzzy_originals=False):
+    def _matched_diff_pair(self, obj1, obj2):
+        """
+        Start comparing an element of the old array with its match in the new array,
+        like _diff_pair(). Fuzzy matching scored the pair as (obj2, obj1), which does not
+        give the changes from obj1 to obj2, but equality does not depend on the order,
+        so an equal score is reused. It does with output_new_only, which ignores deleted
+        members, and with keys_only, which pairs replaced elements up to the old ones.
+        """
+        o = self.options
+        if not (o.output_new_only or o.keys_only or o.full) and self._cache.maxsize != 0 and isinstance(obj1, (dict, list)):
+            scored = self._cache.get((id(obj2), id(obj1)))
+            if scored is not None and scored[2]['equal']:
+                return self._equal_change(obj1), None
+        return self._diff_pair(obj1, obj2)
+
+    def _match_objects(self, array, fuzzy_originals):
+        """
+        Match objects of the array with objects of fuzzy_originals, returns indexes of array
+        mapped to keys of matched originals and the originals left for fuzzy matching
+        """
+        exact_matches = {}
+        if self._hashes is not None and fuzzy_originals:
+            # Objects identical to an original share its key, so they align
+            # as equal without fuzzy matching
+            for index in range(0, len(array)):
+                item = array[index]
+                if self.__is_scalar(item):
+                    continue
+                key = self._hash_key(item)
+                if key in fuzzy_originals and _equal(fuzzy_originals[key]['item'], item, self._precision):
+                    exact_matches[index] = key
+            if exact_matches:
+                claimed = set(exact_matches.values())
+                fuzzy_originals = { key: it for key, it in fuzzy_originals.items() if key not in claimed }
+
         fuzzy_matches = {}
         if fuzzy_originals:
             # Find best fuzzy match for each object in the array
             key_scores = {}
             for index in range(0, len(array)):
+                if self._exhausted:
+                    # out of budget, the remaining objects are left unmatched
+                    self._approximate()
+                    break
                 item = array[index]
-                if self.__is_scalar(item):
+                if self.__is_scalar(item) or index in exact_matches:
                     continue
-                best_match = self._find_matching_object(item, index, fuzzy_originals)
+                best_match = yield from self._find_matching_object(item, index, fuzzy_originals)
                 best_match_key = best_match['key'] if best_match else None
                 if best_match and (best_match_key not in key_scores or best_match['score'] > key_scores[best_match_key]['score']):
                     key_scores[best_match_key] = { 'score': best_match['score'], 'index': index }
             for key, match in key_scores.items():
                 fuzzy_matches[match['index']] = key
-    
+        fuzzy_matches.update(exact_matches)
+        return fuzzy_matches, fuzzy_originals
+
+    def _scalarize(self, array, originals, fuzzy_originals=False, fuzzy_matches=None):
+        p = self._precision
         result = []
         for index in range(0, len(array)):
             item = array[index]
             if self.__is_scalar(item):
-                result.append(item)
+                result.append(_round_scalar(item, p) if p is not None else item)
             else:
                 def incr_return_old(d, key):
                     old = d[key]
                     d[key] = old+1
                     return old
-                key = index in fuzzy_matches and fuzzy_matches[index] or '__$!SCALAR' + str(incr_return_old(originals, '__next'))
+                key = fuzzy_matches.get(index) if fuzzy_matches else None
+                if key is None and self._hashes is not None and not fuzzy_originals:
+                    key = self._hash_key(item)
+                    if key in originals and not _equal(originals[key]['item'], item, self._precision):
+                        # hash collision of two different objects
+                        key = None
+                if key is None:
+                    key = '__$!SCALAR' + str(incr_return_old(originals, '__next'))
                 originals[key] = { 'item': item, 'index': index }
                 result.append(key)
         return result
@@ -134,14 +669,331 @@ class Comparator(object):
         else:
             return item
 
+    def _scalarize_old(self, array, key_fields):
+        """
+        Scalarize an array of the old document by its key fields, or for fuzzy
+        matching if key_fields is empty, returns (seq, originals). Sequences
+        of a Baseline document are looked up instead of computed again.
+        """
+        if self._sequences is not None:
+            entry = self._sequences.get((id(array), key_fields))
+            if entry is not None and entry[0] is array:
+                return entry[1], entry[2]
+        originals = { '__next': 1 }
+        if key_fields:
+            seq = self._scalarize_by_key(array, originals, key_fields)
+        else:
+            seq = self._scalarize(array, originals)
+        return seq, originals
+
+    def _array_key_fields(self):
+        """ Return key fields used to align elements of the array at the current path """
+        if self.options.array_key_patterns:
+            path = _format_path(self._path)
+            for pattern, fields in self.options.array_key_patterns:
+                if pattern.match(path):
+                    return fields
+        return self.options.array_key
+
+    def _is_unordered(self):
+        """ Return True if the array at the current path is compared as a multiset """
+        if self.options.unordered:
+            return True
+        if self.options.unordered_patterns:
+            path = _format_path(self._path)
+            for pattern in self.options.unordered_patterns:
+                if pattern.match(path):
+                    return True
+        return False
+
+    def _scalarize_by_key(self, array, originals, fields):
+        """
+        Scalarize an array of objects by the values of their key fields.
+        Returns None if some element is not an object with all the key fields
+        or if two elements share the same key.
+        """
+        result = []
+        for index in range(0, len(array)):
+            item = array[index]
+            if not isinstance(item, dict):
+                return None
+            try:
+                values = [item[field] for field in fields]
+                if self._precision is not None:
+                    values = _round_copy(values, self._precision)
+                key = '__$!KEY' + json.dumps(values)
+            except (KeyError, TypeError):
+                return None
+            if key in originals:
+                return None
+            originals[key] = { 'item': item, 'index': index }
+            result.append(key)
+        return result
+
     def array_diff(self, obj1, obj2):
         """ Compare two arrays and return {score, equal, result} dict """
-        originals1 = { '__next': 1 }
-        seq1 = self._scalarize(obj1, originals1)
-        originals2 = { '__next': originals1['__next'] }
-        seq2 = self._scalarize(obj2, originals2, originals1)
+        self._start()
+        return self._round_change(self._run(self._array_diff(obj1, obj2)))
+
+    def _array_diff(self, obj1, obj2):
+        key_fields = self._array_key_fields()
+        unordered = self._is_unordered()
+        self._path.append('[]')
+        kind = self._numeric and _numeric_kind(obj1)
+        if unordered:
+            change = self._unordered_array_diff(obj1, obj2)
+        elif kind and kind == _numeric_kind(obj2):
+            if kind == 'numbers':
+                change = self._numeric_array_diff(obj1, obj2)
+            else:
+                # rows of matrices are compared by position as numeric arrays
+                change = yield from self._positional_array_diff(obj1, obj2)
+        elif self._exhausted:
+            self._approximate()
+            change = yield from self._positional_array_diff(obj1, obj2)
+        else:
+            change = yield from self._aligned_array_diff(obj1, obj2, key_fields)
+        self._path.pop()
+        return change
+
+    def _unordered_array_diff(self, obj1, obj2):
+        """
+        Compare arrays as multisets in linear time. Elements are counted by their structural
+        hashes and equal elements are matched regardless of their positions, elements left
+        without a match are removed or added as a whole. Matched elements are kept in the
+        order of obj1, followed by the added elements.
+        """
+        o = self.options
+        typed = self._typed
+        keep_unchanged = o.full or o.keep_unchanged_values
+        precision = self._precision
+        # indexes of unmatched elements of obj1 by hash
+        buckets = {}
+        for index, item in enumerate(obj1):
+            buckets.setdefault(self._hash(item), []).append(index)
+        matched = [False] * len(obj1)
+        added = []
+        for item in obj2:
+            indexes = buckets.get(self._hash(item))
+            if indexes:
+                # hashes of unequal elements may collide
+                for n, index in enumerate(indexes):
+                    if _equal(obj1[index], item, precision):
+                        matched[index] = True
+                        del indexes[n]
+                        break
+                else:
+                    added.append(item)
+            else:
+                added.append(item)
+
+        result = []
+        score = 0
+        for index, item in enumerate(obj1):
+            if matched[index]:
+                if keep_unchanged:
+                    result.append(Unchanged(item) if typed else [OP.NONE, item])
+                else:
+                    result.append(ELIDED if typed else [OP.NONE])
+                score += 10
+            else:
+                result.append(Remove(item) if typed else [OP.REMOVE, item])
+                score -= 5
+        for item in added:
+            result.append(Add(item) if typed else [OP.ADD, item])
+            score -= 5
+
+        equal = len(added) == 0 and all(matched)
+        if equal:
+            if not o.full:
+                result = None
+            else:
+                result = Unchanged(obj1) if typed else obj1
+            score = 100
+        else:
+            score = max(0, score)
+            if typed:
+                result = ArrayDelta(result)
+
+        return { 'score': score, 'result': result, 'equal': equal }
+
+    def _numeric_array_diff(self, obj1, obj2):
+        """
+        Compare arrays of numbers by position. Runs of changed elements are reported as
+        {'__length': len(obj1), '__ranges': [[start, old values, new values], ...]},
+        or a RangeDelta with the typed option, instead of an [op, value] entry
+        per element. Elements beyond the end of the shorter array are a last range.
+        The full and keep_unchanged_values options still produce an entry per element.
+        """
+        o = self.options
+        typed = self._typed
+        n = min(len(obj1), len(obj2))
+        ranges = self._numeric_ranges(obj1, obj2, n)
+        changed = sum(end - start for start, end in ranges)
+        score = 10 * (n - changed) - 10 * changed - 5 * abs(len(obj1) - len(obj2))
+        if len(obj1) != len(obj2):
+            if ranges and ranges[-1][1] == n:
+                start = ranges.pop()[0]
+            else:
+                start = n
+            ranges.append((start, None))
+        ranges = [[start, obj1[start:end], obj2[start:end]] for start, end in ranges]
+
+        if not ranges:
+            if not o.full:
+                result = None
+            else:
+                result = Unchanged(obj1) if typed else obj1
+            return { 'score': 100, 'result': result, 'equal': True }
+
+        if o.full or o.keep_unchanged_values:
+            result = []
+            index = 0
+            for start, old, new in ranges:
+                for item in obj1[index:start]:
+                    result.append(Unchanged(item) if typed else [OP.NONE, item])
+                for item in old:
+                    result.append(Remove(item) if typed else [OP.REMOVE, item])
+                for item in new:
+                    result.append(Add(item) if typed else [OP.ADD, item])
+                index = start + len(old)
+            for item in obj1[index:]:
+                result.append(Unchanged(item) if typed else [OP.NONE, item])
+            if typed:
+                result = ArrayDelta(result)
+        elif typed:
+            result = RangeDelta(len(obj1), ranges)
+        else:
+            result = { '__length': len(obj1), '__ranges': ranges }
+        return { 'score': max(0, score), 'result': result, 'equal': False }
+
+    def _numeric_ranges(self, obj1, obj2, n):
+        """
+        Return (start, end) ranges of indexes of changed numbers among the first n elements
+        of two arrays of numbers. Slices of the arrays are compared with == first, which
+        compares the numbers in C, so only slices with a difference are compared number
+        by number, with the precision, abs_tolerance and rel_tolerance options.
+        """
+        precision = self._precision
+        abs_tolerance = self._abs_tolerance
+        rel_tolerance = self._rel_tolerance
+        tolerant = abs_tolerance > 0 or rel_tolerance > 0
+        ranges = []
+        start = None
+        for i in range(0, n, NUMERIC_SLICE):
+            j = min(n, i + NUMERIC_SLICE)
+            if obj1[i:j] == obj2[i:j]:
+                if start is not None:
+                    ranges.append((start, i))
+                    start = None
+                continue
+            for k in range(i, j):
+                a = obj1[k]
+                b = obj2[k]
+                same = a == b
+                if not same and tolerant:
+                    try:
+                        d = abs(a - b)
+                        same = d <= abs_tolerance or d <= rel_tolerance * max(abs(a), abs(b))
+                    except OverflowError:
+                        pass
+                if not same and precision is not None:
+                    same = _round_scalar(a, precision) == _round_scalar(b, precision)
+                if not same:
+                    if start is None:
+                        start = k
+                elif start is not None:
+                    ranges.append((start, k))
+                    start = None
+        if start is not None:
+            ranges.append((start, n))
+        return ranges
+
+    def _positional_array_diff(self, obj1, obj2):
+        """
+        Compare elements at the same positions in linear time, once the budget is exhausted.
+        Elements of different types or different scalars are replaced as a whole.
+        """
+        o = self.options
+        typed = self._typed
+        keep_unchanged = o.full or o.keep_unchanged_values
+        result = []
+        score = 0
+        equal = True
+
+        for index in range(max(len(obj1), len(obj2))):
+            if index >= len(obj2):
+                result.append(Remove(obj1[index]) if typed else [OP.REMOVE, obj1[index]])
+                score -= 5
+                equal = False
+                continue
+            if index >= len(obj1):
+                result.append(Add(obj2[index]) if typed else [OP.ADD, obj2[index]])
+                score -= 5
+                equal = False
+                continue
+
+            item1 = obj1[index]
+            item2 = obj2[index]
+            if _equal(item1, item2, self._precision) or (o.keys_only and self.__is_scalar(item1) and self.__is_scalar(item2)):
+                if keep_unchanged:
+                    result.append(Unchanged(item1) if typed else [OP.NONE, item1])
+                else:
+                    result.append(ELIDED if typed else [OP.NONE])
+                score += 10
+            elif not self.__is_scalar(item1) and type(item1) == type(item2):
+                change, node = self._diff_pair(item1, item2)
+                if node is not None:
+                    change = yield node
+                if not change['equal']:
+                    result.append(change['result'] if typed else [OP.MODIFY, change['result']])
+                    equal = False
+                elif keep_unchanged:
+                    result.append(Unchanged(item1) if typed else [OP.NONE, item1])
+                else:
+                    result.append(ELIDED if typed else [OP.NONE])
+                score += 10
+            else:
+                result.append(Remove(item1) if typed else [OP.REMOVE, item1])
+                result.append(Add(item2) if typed else [OP.ADD, item2])
+                score -= 10
+                equal = False
+
+        if equal:
+            if not o.full:
+                result = None
+            else:
+                result = Unchanged(obj1) if typed else obj1
+            score = 100
+        else:
+            score = max(0, score)
+            if typed:
+                result = ArrayDelta(result)
+
+        return { 'score': score, 'result': result, 'equal': equal }
+
+    def _aligned_array_diff(self, obj1, obj2, key_fields):
+        seq1 = None
+        if key_fields:
+            # align records by their keys using the originals as a hash index
+            seq1, originals1 = self._scalarize_old(obj1, key_fields)
+            if seq1 is not None:
+                originals2 = { '__next': 1 }
+                seq2 = self._scalarize_by_key(obj2, originals2, key_fields)
+                if seq2 is None:
+                    seq1 = None
+                elif not self.options.sort:
+                    change = yield from self._keyed_array_diff(obj1, obj2, originals1, seq2)
+                    return change
+        if seq1 is None:
+            seq1, originals1 = self._scalarize_old(obj1, ())
+            originals2 = { '__next': originals1['__next'] }
+            fuzzy_matches, fuzzy_originals = yield from self._match_objects(obj2, originals1)
+            seq2 = self._scalarize(obj2, originals2, fuzzy_originals, fuzzy_matches)
     
-        if self._get_opt('sort'):
+        o = self.options
+        keep_unchanged = o.full or o.keep_unchanged_values
+        if o.sort:
             def mixd(num):
                 try:
                     el = int(num)
@@ -150,11 +1002,13 @@ class Comparator(object):
                     return (1, num)
             # json_diff in JS sorts alphanumerically (key=str)
             # it should probably use a mixed method (key=mixd) instead
-            seq1.sort(key=mixd)
+            # seq1 may be shared by a Baseline, sort a copy
+            seq1 = sorted(seq1, key=mixd)
             seq2.sort(key=mixd)
 
-        opcodes = SequenceMatcher(None, seq1, seq2).get_opcodes()
+        opcodes = self._sequence_opcodes(seq1, seq2)
     
+        typed = self._typed
         result = []
         score = 0
         equal = True
@@ -164,7 +1018,7 @@ class Comparator(object):
             asc, end = (0, 0)
             asc1, end1 = (0, 0)
             asc2, end2 = (0, 0)
-            if not (op == 'equal' or (self._get_opt('keys_only') and op == 'replace')):
+            if not (op == 'equal' or (o.keys_only and op == 'replace')):
                 equal = False
         
             if op == 'equal':
@@ -177,111 +1031,442 @@ class Comparator(object):
                             raise ParserError(f'internal bug: is_scalarized(item, originals1) != is_scalarized(item, originals2) for item {json.dumps(item, indent=2)}')
                         item1 = self._descalarize(item, originals1)
                         item2 = self._descalarize(item, originals2)
-                        change = self.diff(item1, item2)
+                        change, node = self._matched_diff_pair(item1, item2)
+                        if node is not None:
+                            change = yield node
                         if not change['equal']:
-                            result.append([OP.MODIFY, change['result']])
+                            result.append(change['result'] if typed else [OP.MODIFY, change['result']])
                             equal = False
                         else:
-                            if self._get_opt('full') or self._get_opt('keep_unchanged_values'):
-                                result.append([OP.NONE, item1])
+                            if keep_unchanged:
+                                result.append(Unchanged(item1) if typed else [OP.NONE, item1])
                             else:
-                                result.append([OP.NONE])
+                                result.append(ELIDED if typed else [OP.NONE])
                     else:
-                        if self._get_opt('full') or self._get_opt('keep_unchanged_values'):
-                            result.append([OP.NONE, item])
+                        if keep_unchanged:
+                            result.append(Unchanged(item) if typed else [OP.NONE, item])
                         else:
-                            result.append([OP.NONE])
+                            result.append(ELIDED if typed else [OP.NONE])
                     score += 10
             elif op == 'delete':
                 end1 = i2
                 asc1 = i1 <= end1
                 for i in range(i1, end1, 1 if asc1 else -1):
-                    result.append([OP.REMOVE, self._descalarize(seq1[i], originals1)])
+                    value = self._descalarize(seq1[i], originals1)
+                    result.append(Remove(value) if typed else [OP.REMOVE, value])
                     score -= 5
             elif op == 'insert':
                 end2 = j2
                 asc2 = j1 <= end2
                 for j in range(j1, end2, 1 if asc2 else -1):
-                    result.append([OP.ADD, self._descalarize(seq2[j], originals2)])
+                    value = self._descalarize(seq2[j], originals2)
+                    result.append(Add(value) if typed else [OP.ADD, value])
                     score -= 5
             elif op == 'replace':
-                if not self._get_opt('keys_only'):
+                if not o.keys_only:
                     asc3, end3 = (0, 0)
                     asc4, end4 = (0, 0)
                     end3 = i2
                     asc3 = i1 <= end3
                     for i in range(i1, end3, 1 if asc3 else -1):
-                        result.append([OP.REMOVE, self._descalarize(seq1[i], originals1)])
+                        value = self._descalarize(seq1[i], originals1)
+                        result.append(Remove(value) if typed else [OP.REMOVE, value])
                         score -= 5
                     end4 = j2
                     asc4 = j1 <= end4
-                    for j in range(i1, end4, 1 if asc4 else -1):
-                        result.append([OP.ADD, self._descalarize(seq2[j], originals2)])
+                    for j in range(j1, end4, 1 if asc4 else -1):
+                        value = self._descalarize(seq2[j], originals2)
+                        result.append(Add(value) if typed else [OP.ADD, value])
                         score -= 5
                 else:
                     asc5, end5 = (0, 0)
                     end5 = i2
                     asc5 = i1 <= end5
                     for i in range(i1, end5, 1 if asc5 else -1):
-                        change = self.diff(
+                        change, node = self._diff_pair(
                             self._descalarize(seq1[i], originals1),
                             self._descalarize(seq2[i - i1 + j1], originals2)
                         )
+                        if node is not None:
+                            change = yield node
                         if not change['equal']:
-                            result.append([OP.MODIFY, change['result']])
+                            result.append(change['result'] if typed else [OP.MODIFY, change['result']])
                             equal = False
                         else:
-                            result.append([OP.NONE])
+                            result.append(ELIDED if typed else [OP.NONE])
         
         if equal or len(opcodes) == 0:
-            if not self._get_opt('full'):
+            if not o.full:
                 result = None
             else:
-                result = obj1
+                result = Unchanged(obj1) if typed else obj1
             score = 100
         else:
           score = max(0, score)
+          if typed:
+              result = ArrayDelta(result)
     
         return { 'score': score, 'result': result, 'equal': equal }
 
+    def _keyed_array_diff(self, obj1, obj2, originals1, seq2):
+        """
+        Compare arrays of records aligned by their keys. Records with equal keys are
+        paired through the originals1 index and compared with each other, records
+        without a pair are removed or added. The longest run of pairs keeping their
+        order stays in place, the other pairs are reported as moved from their index
+        in obj1: [OP.MOVE, index, entry] where entry is the [OP.NONE, value] or
+        [OP.MODIFY, change] entry of the record, or a Move node with the typed option.
+        """
+        o = self.options
+        typed = self._typed
+        keep_unchanged = o.full or o.keep_unchanged_values
+        # indexes in obj1 of the records of obj2, None for added records
+        sources = []
+        for key in seq2:
+            original = originals1.get(key)
+            sources.append(original['index'] if original is not None else None)
+        paired = [j for j, i in enumerate(sources) if i is not None]
+        stable = [paired[n] for n in _increasing_subsequence([sources[j] for j in paired])]
+        kept = [False] * len(obj1)
+        for i in sources:
+            if i is not None:
+                kept[i] = True
+
+        result = []
+        score = 0
+        equal = True
+        prev_i = prev_j = -1
+        for j in stable + [len(obj2)]:
+            i = sources[j] if j < len(obj2) else len(obj1)
+            for k in range(prev_i + 1, i):
+                if not kept[k]:
+                    result.append(Remove(obj1[k]) if typed else [OP.REMOVE, obj1[k]])
+                    score -= 5
+                    equal = False
+            for k in range(prev_j + 1, j):
+                source = sources[k]
+                if source is None:
+                    result.append(Add(obj2[k]) if typed else [OP.ADD, obj2[k]])
+                    score -= 5
+                    equal = False
+                    continue
+                item1 = obj1[source]
+                change, node = self._diff_pair(item1, obj2[k])
+                if node is not None:
+                    change = yield node
+                if not change['equal']:
+                    entry = change['result'] if typed else [OP.MODIFY, change['result']]
+                else:
+                    entry = Unchanged(item1) if typed else [OP.NONE, item1]
+                result.append(Move(source, entry) if typed else [OP.MOVE, source, entry])
+                score += 5
+                equal = False
+            if j == len(obj2):
+                break
+            item1 = obj1[i]
+            change, node = self._diff_pair(item1, obj2[j])
+            if node is not None:
+                change = yield node
+            if not change['equal']:
+                result.append(change['result'] if typed else [OP.MODIFY, change['result']])
+                equal = False
+            elif keep_unchanged:
+                result.append(Unchanged(item1) if typed else [OP.NONE, item1])
+            else:
+                result.append(ELIDED if typed else [OP.NONE])
+            score += 10
+            prev_i, prev_j = i, j
+
+        if equal:
+            if not o.full:
+                result = None
+            else:
+                result = Unchanged(obj1) if typed else obj1
+            score = 100
+        else:
+            score = max(0, score)
+            if typed:
+                result = ArrayDelta(result)
+
+        return { 'score': score, 'result': result, 'equal': equal }
+
     def diff(self, obj1, obj2):
         """ Compare two objects of any type and return a dict with differences """
+        self._start()
+        change, node = self._diff_pair(obj1, obj2)
+        if node is not None:
+            change = self._run(node)
+        return self._round_change(change)
+
+    def _round_change(self, change):
+        """
+        Values are compared rounded to the precision option, but the result refers
+        to the original values, return the change with a rounded copy of the result
+        """
+        if self._precision is None or change['result'] is None or self.options.summary:
+            return change
+        return dict(change, result=_round_copy(change['result'], self._precision))
+
+    def _start(self):
+        """
+        Forget the cached comparisons and hashes of the previous comparison, keyed by
+        the ids of values that may have been modified or freed since
+        """
+        self._cache.clear()
+        if self._hashes is not None:
+            self._hashes = {} if self._baseline_hashes is None else dict(self._baseline_hashes)
+
+    def _run(self, node):
+        """
+        Run a comparison generator and return its change. Generators comparing objects
+        and arrays yield generators comparing their nested objects and arrays and receive
+        their changes, so nested values are compared using an explicit stack instead
+        of recursion and documents can be nested to any depth.
+        """
+        stack = [node]
+        change = None
+        while True:
+            try:
+                node = stack[-1].send(change)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                change = stop.value
+                continue
+            stack.append(node)
+            change = None
+
+    def _container_diff(self, obj1, obj2, key):
+        if self._path_filter is not None:
+            change = yield from self._filtered_container_diff(obj1, obj2)
+        elif isinstance(obj1, dict):
+            change = yield from self._object_diff(obj1, obj2)
+        else:
+            change = yield from self._array_diff(obj1, obj2)
+        if self.options.summary and change['result'] is not None:
+            change = dict(change, result=self._summarize(obj1, obj2, change['result']))
+        self._cache.put(key, (obj1, obj2, change))
+        return change
+
+    def _filtered_container_diff(self, obj1, obj2):
+        """
+        Compare objects without their members excluded by the ignore and only options,
+        so that excluded subtrees are never visited. Arrays whose elements are excluded
+        are equal.
+        """
+        path_filter = self._path_filter
+        state = self._filter_state()
+        if isinstance(obj1, dict):
+            change = yield from self._object_diff(path_filter.members(obj1, state), path_filter.members(obj2, state))
+        elif path_filter.allowed(path_filter.step(state, '[]')):
+            change = yield from self._array_diff(obj1, obj2)
+        else:
+            change = yield from self._array_diff([], [])
+        return change
+
+    def _filter_state(self):
+        """
+        Return the path filter state of the object or array being compared. States are
+        kept by path length: the state of a container is derived from the state of its
+        parent, which is always the last one compared at the length of its path.
+        """
+        path_filter = self._path_filter
+        states = self._filter_states
+        path = self._path
+        depth = len(path)
+        # states of the path above the root of the comparison
+        while len(states) < depth:
+            n = len(states)
+            states.append(path_filter.step(states[-1], path[n - 1]) if n else path_filter.root)
+        del states[depth:]
+        state = path_filter.step(states[-1], path[-1]) if depth else path_filter.root
+        states.append(state)
+        return state
+
+    def _counted_container_diff(self, obj1, obj2, key):
+        """ _container_diff counted in stats, used instead of it with the stats option """
+        token = self.stats.start('object_diff' if isinstance(obj1, dict) else 'array_diff', self._path)
+        change = yield from Comparator._container_diff(self, obj1, obj2, key)
+        self.stats.stop(token)
+        return change
+
+    def _counted_sequence_opcodes(self, seq1, seq2):
+        """ Sequence engine counted in stats, used instead of it with the stats option """
+        token = self.stats.start('sequence', self._path)
+        opcodes = SEQUENCE_ENGINES[self.options.sequence_engine](seq1, seq2)
+        self.stats.stop(token)
+        return opcodes
+
+    def _diff_pair(self, obj1, obj2):
+        """
+        Start comparing two values, returns (change, None) if the change is known
+        right away or (None, generator) to be run for objects and arrays
+        """
         type1 = _extend_typeof(obj1)
         type2 = _extend_typeof(obj2)
     
-        if type1 == type2:
-            if type1 == 'object':
-                return self.object_diff(obj1, obj2)
-            elif type1 == 'array':
-                return self.array_diff(obj1, obj2)
+        if type1 == type2 and (type1 == 'object' or type1 == 'array'):
+            # values shared by both documents, e.g. loaded from identical bytes
+            if obj1 is obj2 and not self.options.full:
+                return self._equal_change(obj1), None
+            # fuzzy array matching scores the same pairs of subtrees
+            # repeatedly, so remember the result of every comparison
+            # hashes differ for all unequal subtrees, so equality needs
+            # to be confirmed only when they match
+            if self._hashes is not None and self._hash(obj1) == self._hash(obj2) and _equal(obj1, obj2, self._precision):
+                return self._equal_change(obj1), None
+            key = (id(obj1), id(obj2))
+            if self._cache.maxsize != 0:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    return cached[2], None
+            if self._budgeted:
+                self._over_budget()
+            return None, self._container_diff(obj1, obj2, key)
     
         # Compare primitives or complex objects of different types
         score = 100
         result = obj1
         equal = False
-        if not self._get_opt('keys_only', False):
+        o = self.options
+        if not o.keys_only:
             equal = obj1 == obj2
+            if not equal and self._precision is not None:
+                equal = _round_scalar(obj1, self._precision) == _round_scalar(obj2, self._precision)
             if not equal:
                 score = 0
         
-                if self._get_opt('output_new_only', False):
+                if self._typed:
+                    result = Modify(obj1, obj2)
+                elif o.output_new_only:
                     result = obj2
                 else:
                     result = { '__old': obj1, '__new': obj2 }
-            elif not self._get_opt('full', False):
+            elif not o.full:
                 result = None
+            elif self._typed:
+                result = Unchanged(obj1)
         else:
             equal = True
             result = None
     
-        return { 'score': score, 'result': result, 'equal': equal }
+        return { 'score': score, 'result': result, 'equal': equal }, None
+
+    def equal(self, obj1, obj2):
+        """
+        Return True if diff() would find no differences between obj1 and obj2, without
+        building the diff: values are compared until the first difference. With the
+        keys_only, sort, unordered, ignore, only or tolerance options equality depends on
+        how arrays are aligned or which values are compared, so the documents are diffed instead.
+        """
+        o = self.options
+        if o.keys_only or o.sort or o.unordered or o.unordered_patterns or self._path_filter is not None \
+                or self._abs_tolerance > 0 or self._rel_tolerance > 0:
+            return self.diff(obj1, obj2)['equal']
+        if not o.output_new_only:
+            return _equal(obj1, obj2, self._precision)
+        # deleted members are not differences with output_new_only
+        stack = [(obj1, obj2)]
+        while stack:
+            a, b = stack.pop()
+            if isinstance(a, dict) and isinstance(b, dict):
+                if not b.keys() <= a.keys():
+                    return False
+                stack.extend((a[key], value) for key, value in b.items())
+            elif isinstance(a, list) and isinstance(b, list):
+                if len(a) != len(b):
+                    return False
+                stack.extend(zip(a, b))
+            elif not _equal(a, b, self._precision):
+                return False
+        return True
+
+    def summary(self, obj1, obj2):
+        """
+        Count changes between obj1 and obj2 by the first summary_depth components of their
+        paths and return a Summary. The diff is not built: the result of every object and
+        array comparison is replaced by its counts as soon as it is complete.
+        """
+        if not self.options.summary:
+            return Comparator(self.options.replace(summary=True)).summary(obj1, obj2)
+        self._start()
+        change, node = self._diff_pair(obj1, obj2)
+        if node is not None:
+            change = self._run(node)
+        result = change['result']
+        if result is None:
+            return Summary()
+        if type(result) is Summary:
+            return result
+        # changed scalars at the root
+        summary = Summary()
+        summary.count(_format_path(self._path[:self.options.summary_depth]), MODIFIED)
+        return summary
+
+    def _summarize(self, obj1, obj2, result):
+        """ Return the counts of changes of an object or array result, nested results are already counted """
+        summary = Summary()
+        path = self._path
+        depth = self.options.summary_depth
+        # prefixes are the same for all members below the summary depth
+        prefix = _format_path(path[:depth]) if len(path) >= depth else None
+        if type(result) is dict and _is_ranges(result):
+            if prefix is None:
+                prefix = _format_path((path + ['[]'])[:depth])
+            for start, old, new in result['__ranges']:
+                common = min(len(old), len(new))
+                summary.count(prefix, MODIFIED, common)
+                summary.count(prefix, REMOVED, len(old) - common)
+                summary.count(prefix, ADDED, len(new) - common)
+        elif isinstance(result, dict):
+            for key, value in result.items():
+                if type(value) is Summary:
+                    summary.merge(value)
+                    continue
+                if key in obj1 and key in obj2:
+                    kind = MODIFIED
+                elif self.options.output_new_only:
+                    # added keys have no suffix and deleted keys are left out
+                    kind = ADDED
+                elif key.endswith('__deleted'):
+                    kind, key = REMOVED, key[:-len('__deleted')]
+                else:
+                    kind, key = ADDED, key[:-len('__added')]
+                summary.count(prefix if prefix is not None else _format_path((path + [key])[:depth]), kind)
+        else:
+            if prefix is None:
+                prefix = _format_path((path + ['[]'])[:depth])
+            for entry in result:
+                op = entry[0]
+                if op == OP.MOVE:
+                    # a moved value is modified, changes within it are counted too
+                    summary.count(prefix, MODIFIED)
+                    entry = entry[2]
+                    op = entry[0]
+                if op == OP.MODIFY:
+                    summary.merge(entry[1])
+                elif op == OP.ADD:
+                    summary.count(prefix, ADDED)
+                elif op == OP.REMOVE:
+                    summary.count(prefix, REMOVED)
+        return summary
 
 def diff(obj1, obj2, opts = None):
     """
-    Compare two objects and return a dict with differences
+    Compare two objects and return a dict with differences,
+    or a tree of Delta nodes with the typed option
     """
-    p = _get_opt(opts, 'precision', None)
-    if p is not None:
-        obj1 = _round_obj(obj1, p)
-        obj2 = _round_obj(obj2, p)
-    return Comparator(opts).diff(obj1, obj2)['result']
+    return _compare(Comparator(opts), obj1, obj2)
+
+def equal(obj1, obj2, opts = None):
+    """ Return True if obj1 and obj2 have no differences, stopping at the first one """
+    return Comparator(opts).equal(obj1, obj2)
+
+def summary(obj1, obj2, opts = None):
+    """ Count changes between obj1 and obj2 by path prefix without building the diff, returns a Summary """
+    return Comparator(Options.of(opts).replace(summary=True)).summary(obj1, obj2)
+
+def _compare(comparator, obj1, obj2):
+    """ Compare obj1 with obj2 using the comparator and return the result """
+    return comparator.diff(obj1, obj2)['result']
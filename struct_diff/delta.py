@@ -0,0 +1,176 @@
+"""
+Typed diff representation.
+
+With the typed option Comparator builds the diff from these node classes
+instead of dicts with magic __old/__new/__added/__deleted keys and [op, value]
+lists. Formatters consume the nodes directly and to_dict() converts them
+to the dict format on demand.
+"""
+
+from .util import OP
+
+class Delta(object):
+    """ Base class of typed diff nodes """
+    __slots__ = ()
+
+    def to_dict(self, new_only=False):
+        """
+        Convert the node to the dict format produced by Comparator without the typed option.
+        new_only renders the node as with the output_new_only option.
+        """
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        args = ', '.join(repr(getattr(self, name)) for name in self.__slots__)
+        return f'{type(self).__name__}({args})'
+
+class Modify(Delta):
+    """ A value replaced by a different scalar or a value of a different type """
+    __slots__ = ('old', 'new')
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+    def to_dict(self, new_only=False):
+        if new_only:
+            return self.new
+        return { '__old': self.old, '__new': self.new }
+
+class Add(Delta):
+    """ An object key or an array element present only in the new value """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self, new_only=False):
+        # the containing object or array marks the value as added
+        return self.value
+
+class Remove(Delta):
+    """ An object key or an array element present only in the old value """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self, new_only=False):
+        # the containing object or array marks the value as removed
+        return self.value
+
+class Move(Delta):
+    """
+    An array element moved from index source of the old array, delta is
+    Unchanged with its value or the nested delta node of its changes
+    """
+    __slots__ = ('source', 'delta')
+
+    def __init__(self, source, delta):
+        self.source = source
+        self.delta = delta
+
+    def to_dict(self, new_only=False):
+        # the containing array holds the source index
+        return self.delta.to_dict(new_only)
+
+class Unchanged(Delta):
+    """ A value equal in both documents, included in full mode or as context """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self, new_only=False):
+        return self.value
+
+class Elided(Delta):
+    """ An unchanged array element whose value is omitted, use the ELIDED instance """
+    __slots__ = ()
+
+    def to_dict(self, new_only=False):
+        # the value is omitted
+        return None
+
+    def __reduce__(self):
+        return 'ELIDED'
+
+ELIDED = Elided()
+
+class ObjectDelta(Delta):
+    """ Changes of an object, a dict of keys to their Delta nodes """
+    __slots__ = ('changes',)
+
+    def __init__(self, changes=None):
+        self.changes = {} if changes is None else changes
+
+    def to_dict(self, new_only=False):
+        result = {}
+        for key, child in self.changes.items():
+            typ = type(child)
+            if typ is Remove:
+                result[f'{key}__deleted'] = child.value
+            elif typ is Add:
+                result[key if new_only else f'{key}__added'] = child.value
+            else:
+                result[key] = child.to_dict(new_only)
+        return result
+
+class ArrayDelta(Delta):
+    """
+    Changes of an array, a list of Add, Remove, Move, Unchanged and ELIDED
+    nodes or nested delta nodes of modified elements
+    """
+    __slots__ = ('items',)
+
+    def __init__(self, items=None):
+        self.items = [] if items is None else items
+
+    def to_dict(self, new_only=False):
+        result = []
+        for child in self.items:
+            if type(child) is Move:
+                result.append([OP.MOVE, child.source, _array_entry(child.delta, new_only)])
+            else:
+                result.append(_array_entry(child, new_only))
+        return result
+
+def _array_entry(child, new_only):
+    """ Convert a child node of an ArrayDelta to an [op, value] entry """
+    typ = type(child)
+    if typ is Elided:
+        return [OP.NONE]
+    elif typ is Unchanged:
+        return [OP.NONE, child.value]
+    elif typ is Remove:
+        return [OP.REMOVE, child.value]
+    elif typ is Add:
+        return [OP.ADD, child.value]
+    return [OP.MODIFY, child.to_dict(new_only)]
+
+class RangeDelta(Delta):
+    """
+    Changes of an array of numbers compared by position, a list of [start, old values,
+    new values] runs of changed elements, length is the length of the old array
+    """
+    __slots__ = ('length', 'ranges')
+
+    def __init__(self, length, ranges=None):
+        self.length = length
+        self.ranges = [] if ranges is None else ranges
+
+    def to_dict(self, new_only=False):
+        return { '__length': self.length, '__ranges': [list(r) for r in self.ranges] }
+
+def to_dict(delta, new_only=False):
+    """ Convert a typed diff to the dict format, None (no differences) stays None """
+    return None if delta is None else delta.to_dict(new_only)
@@ -1,11 +1,13 @@
-import math
-import re
 import json
+import time
 from abc import ABC, abstractmethod
 from typing import Any
 
-from ..util import _get_opt, _extend_typeof, _is_scalar
+from ..util import _get_opt, _is_scalar, _is_ranges
 from ..comparator import OP
+from ..options import Options
+from ..stats import Stats
+from ..delta import Delta, Modify, Add, Remove, Move, Unchanged, Elided, ObjectDelta, ArrayDelta, RangeDelta
 
 class FormatterError(ValueError):
     pass
@@ -19,12 +21,38 @@ class Part:
     ARRAY_BEGIN = 'A'
     ARRAY_END = 'a'
 
+_DIFF_OPS = frozenset((OP.NONE, OP.REMOVE, OP.ADD, OP.MODIFY))
+# returned by next() once a walker of a nested value is done
+_WALKED = object()
+
+def _looks_like_diff(array) -> bool:
+    """Returns True if all array items are [op, value] pairs, [' '] elisions or ['>', index, item] moves"""
+    for item in array:
+        if not isinstance(item, list):
+            return False
+        n = len(item)
+        if n == 2:
+            op = item[0]
+            if not (isinstance(op, str) and op in _DIFF_OPS):
+                return False
+        elif n == 3:
+            if item[0] != OP.MOVE or not isinstance(item[1], int) or not _looks_like_diff([item[2]]):
+                return False
+        elif n != 1 or item[0] != OP.NONE:
+            return False
+    return True
+
+def _is_scalar_modify(diff) -> bool:
+    """Returns True if a dict diff is an {__old, __new} change of a scalar to another scalar"""
+    return ('__old' in diff) and ('__new' in diff) and _is_scalar(diff['__old']) and _is_scalar(diff['__new'])
+
 _ansi = lambda code: '\x1b['+str(code)+'m'
 
 Theme = {
     OP.NONE: lambda c: c,
     OP.ADD: lambda c: _ansi(32) + c +_ansi(0),
     OP.REMOVE: lambda c: _ansi(31) + c +_ansi(0),
+    OP.MOVE: lambda c: _ansi(33) + c +_ansi(0),
 }
 
 class BaseFormatter(ABC):
@@ -33,6 +61,12 @@ class BaseFormatter(ABC):
     def __init__(self, diff = None, opts = None):
         self.diff = diff
         self.opts = opts
+        self.options = Options.of(opts)
+        self._theme = self.options.theme or Theme
+        # counts and times of output lines with the stats option, see _iter_output()
+        self.stats = Stats(self.options.stats_depth) if self.options.stats else None
+        # path prefix of the diff node being output
+        self._stats_prefix = ''
 
     def _get_opt(self, key, default=False):
         return _get_opt(self.opts, key, default)
@@ -42,7 +76,7 @@ class BaseFormatter(ABC):
         pass
 
     def _output_elisions(self, context: Any, n, depth: int):
-        max_elisions = self._get_opt('max_elisions', math.inf)
+        max_elisions = self.options.max_elisions
         if n < max_elisions:
             for i in range(0, n):
                 self._output(context, OP.NONE, Part.ELISION, '', '...', depth)
@@ -50,46 +84,123 @@ class BaseFormatter(ABC):
             self._output(context, OP.NONE, Part.ELISION, '', f'... ({n} entries)', depth)
 
     def _output_diff(self, context: Any, key: str, diff: Any, op = OP.NONE, depth = 0):
+        """
+        Walks the diff and passes its parts to _output. It is a generator yielding
+        after every output, so that the produced lines can be consumed incrementally.
+        Nested values are walked using an explicit stack, so the diff can be nested
+        to any depth: walkers of objects and arrays yield the arguments of a nested
+        value to walk next, or None after an output.
+        """
+        walk = self._walk
+        stack = [walk(context, key, diff, op, depth)]
+        stats = self.stats
+        if stats is not None:
+            # components of the path of the node being output by depth
+            # and the depths of the walkers on the stack
+            path = [''] * max(0, depth - 1)
+            self._stats_path(path, key, depth)
+            depths = [depth]
+        while stack:
+            if stats is not None:
+                self._stats_prefix = stats.prefix(path[:depths[-1]])
+            nested = next(stack[-1], _WALKED)
+            if nested is None:
+                yield
+            elif nested is _WALKED:
+                stack.pop()
+                if stats is not None:
+                    depths.pop()
+            else:
+                if stats is not None:
+                    self._stats_prefix = self._stats_path(path, nested[1], nested[4])
+                if isinstance(nested[2], (dict, list, Delta)):
+                    value = nested[2]
+                    if type(value) is dict and len(value) == 2 and _is_scalar_modify(value):
+                        # changed scalars are output right away
+                        self._output(nested[0], OP.MODIFY, Part.BODY, nested[1], value, nested[4])
+                        yield
+                    else:
+                        stack.append(walk(*nested))
+                        if stats is not None:
+                            depths.append(nested[4])
+                else:
+                    # scalars are output right away
+                    context, key, value, op, depth = nested
+                    if value == 0 or value is None or value == False or value == '' or value:
+                        self._output(context, op, Part.BODY, key, value, depth)
+                        yield
+
+    def _stats_path(self, path, key, depth):
+        """ Set the path component of the node with key at depth, returns the stats prefix of its path """
+        if depth > 0:
+            del path[depth - 1:]
+            path.append(key if key != '' else '[]')
+        return self.stats.prefix(path[:depth])
+
+    def _iter_output(self, walker, lines):
+        """
+        Runs an _output_diff walker and yields the lines its outputs append to lines.
+        With the stats option, lines and the time spent producing them are counted
+        by the path prefix of the node they belong to.
+        """
+        stats = self.stats
+        if stats is None:
+            for _ in walker:
+                if lines:
+                    yield from lines
+                    lines.clear()
+            return
+        while True:
+            start = time.perf_counter()
+            if next(walker, _WALKED) is _WALKED:
+                return
+            stats.add('lines', self._stats_prefix, time.perf_counter() - start, len(lines))
+            if lines:
+                yield from lines
+                lines.clear()
+
+    def _walk(self, context: Any, key: str, diff: Any, op = OP.NONE, depth = 0):
+        """ Outputs the parts of a diff node, see _output_diff """
         subvalue = None
         subdepth = depth+1
 
-        typ = _extend_typeof(diff)
-        if typ == 'object':
+        if isinstance(diff, Delta):
+            yield from self._walk_delta(context, key, diff, op, depth)
+        elif isinstance(diff, dict):
             if ('__old' in diff) and ('__new' in diff) and (len(diff) == 2):
-                if _is_scalar(diff['__old']) and _is_scalar(diff['__new']):
-                    return self._output(context, OP.MODIFY, Part.BODY, key, diff, depth)
+                if _is_scalar_modify(diff):
+                    self._output(context, OP.MODIFY, Part.BODY, key, diff, depth)
+                    yield
                 else:
-                    self._output_diff(context, key, diff['__old'], OP.REMOVE, depth)
-                    return self._output_diff(context, key, diff['__new'], OP.ADD, depth)
+                    yield (context, key, diff['__old'], OP.REMOVE, depth)
+                    yield (context, key, diff['__new'], OP.ADD, depth)
+            elif _is_ranges(diff):
+                yield from self._walk_ranges(context, key, diff['__length'], diff['__ranges'], op, depth)
             else:
                 self._output(context, op, Part.OBJECT_BEGIN, key, None, depth)
-                for subkey in diff:
-                    m = None
-                    subvalue = diff[subkey]
-                    m = re.match(r'^(.*)__deleted$', subkey)
-                    if m:
-                        self._output_diff(context, m[1], subvalue, OP.REMOVE, subdepth)
+                yield
+                for subkey, subvalue in diff.items():
+                    if subkey.endswith('__deleted'):
+                        yield (context, subkey[:-9], subvalue, OP.REMOVE, subdepth)
+                    elif subkey.endswith('__added'):
+                        yield (context, subkey[:-7], subvalue, OP.ADD, subdepth)
                     else:
-                        m = re.match(r'^(.*)__added$', subkey)
-                        if m:
-                            self._output_diff(context, m[1], subvalue, OP.ADD, subdepth)
-                        else:
-                            self._output_diff(context, subkey, subvalue, op, subdepth)
-                return self._output(context, op, Part.OBJECT_END, key, None, depth)
-
-        elif typ == 'array':
+                        yield (context, subkey, subvalue, op, subdepth)
+                self._output(context, op, Part.OBJECT_END, key, None, depth)
+                yield
+
+        elif isinstance(diff, list):
             self._output(context, op, Part.ARRAY_BEGIN, key, None, depth)
+            yield
         
-            looks_like_diff = True
-            for item in diff:
-                if (_extend_typeof(item) != 'array') or not ((len(item) == 2) or ((len(item) == 1) and (item[0] == ' '))) or not (isinstance(item[0], str)) or (len(item[0]) != 1) or item[0] not in [' ', '-', '+', '~']:
-                    looks_like_diff = False
-        
-            if looks_like_diff:
+            if _looks_like_diff(diff):
                 subop = OP.NONE
                 elision_count = 0
                 for it in diff:
                     subop = it[0]
+                    if subop == OP.MOVE:
+                        # moved elements are output at their new position with their changes
+                        it = it[2]
                     subvalue = it[1] if len(it) > 1 else None
                     if subop == OP.NONE and subvalue is None:
                         elision_count+=1
@@ -98,52 +209,168 @@ class BaseFormatter(ABC):
                             self._output_elisions(context, elision_count, subdepth)
                         elision_count = 0
             
-                        if subop not in [OP.NONE, OP.MODIFY, OP.ADD, OP.REMOVE]:
+                        if subop not in _DIFF_OPS and subop != OP.MOVE:
                             raise FormatterError(f'Unexpected op \'{subop}\' in {json.dumps(diff, indent="  ")}')
                         
                         if subop == OP.MODIFY:
                             subop = OP.NONE
 
-                        self._output_diff(context, '', subvalue, subop, subdepth)
+                        yield (context, '', subvalue, subop, subdepth)
 
                         if elision_count > 0:
                             self._output_elisions(context, elision_count, subdepth)
             else:
                 for subvalue in diff:
-                    self._output_diff(context, '', subvalue, op, subdepth)
+                    yield (context, '', subvalue, op, subdepth)
         
-            return self._output(context, op, Part.ARRAY_END, key, None, depth)
+            self._output(context, op, Part.ARRAY_END, key, None, depth)
+            yield
         else:
             if diff == 0 or diff is None or diff == False or diff == '' or diff:
-                return self._output(context, op, Part.BODY, key, diff, depth)
+                self._output(context, op, Part.BODY, key, diff, depth)
+                yield
 
-    def stringify(self, diff = None, opts = None):
+    def _walk_delta(self, context: Any, key: str, delta: Delta, op = OP.NONE, depth = 0):
         """
-        Produces a human-readable diff text lines from a dict of differences created by Comparator.
+        Walks a typed diff produced with the typed option, passing the same parts
+        to _output as _output_diff does for the equivalent dict diff.
+        """
+        subdepth = depth+1
+        typ = type(delta)
+        new_only = self.options.output_new_only
+
+        if typ is ObjectDelta:
+            self._output(context, op, Part.OBJECT_BEGIN, key, None, depth)
+            yield
+            for subkey, child in delta.changes.items():
+                childtyp = type(child)
+                if childtyp is Remove:
+                    yield (context, subkey, child.value, OP.REMOVE, subdepth)
+                elif childtyp is Add:
+                    yield (context, subkey, child.value, op if new_only else OP.ADD, subdepth)
+                elif childtyp is Unchanged:
+                    yield (context, subkey, child.value, op, subdepth)
+                else:
+                    yield (context, subkey, child, op, subdepth)
+            self._output(context, op, Part.OBJECT_END, key, None, depth)
+            yield
+
+        elif typ is ArrayDelta:
+            self._output(context, op, Part.ARRAY_BEGIN, key, None, depth)
+            yield
+            elision_count = 0
+            for child in delta.items:
+                childtyp = type(child)
+                if childtyp is Elided or (childtyp is Unchanged and child.value is None):
+                    # an unchanged null is [' ', None] in the dict format, output as an elision too
+                    elision_count += 1
+                    continue
+                if elision_count > 0:
+                    self._output_elisions(context, elision_count, subdepth)
+                    elision_count = 0
+                if childtyp is Remove:
+                    yield (context, '', child.value, OP.REMOVE, subdepth)
+                elif childtyp is Add:
+                    yield (context, '', child.value, OP.ADD, subdepth)
+                elif childtyp is Unchanged:
+                    yield (context, '', child.value, OP.NONE, subdepth)
+                elif childtyp is Move:
+                    moved = child.delta
+                    yield (context, '', moved.value if type(moved) is Unchanged else moved, OP.MOVE, subdepth)
+                else:
+                    yield (context, '', child, OP.NONE, subdepth)
+            self._output(context, op, Part.ARRAY_END, key, None, depth)
+            yield
+
+        elif typ is RangeDelta:
+            yield from self._walk_ranges(context, key, delta.length, delta.ranges, op, depth)
+
+        elif typ is Modify:
+            if new_only:
+                yield (context, key, delta.new, op, depth)
+            elif _is_scalar(delta.old) and _is_scalar(delta.new):
+                self._output(context, OP.MODIFY, Part.BODY, key, { '__old': delta.old, '__new': delta.new }, depth)
+                yield
+            else:
+                yield (context, key, delta.old, OP.REMOVE, depth)
+                yield (context, key, delta.new, OP.ADD, depth)
+
+        elif typ is Unchanged:
+            yield (context, key, delta.value, op, depth)
+
+        else:
+            raise FormatterError(f'Unexpected delta {delta!r}')
+
+    def _walk_ranges(self, context: Any, key: str, length: int, ranges, op = OP.NONE, depth = 0):
+        """ Outputs changed ranges of an array of numbers like an array diff with elisions """
+        subdepth = depth+1
+        self._output(context, op, Part.ARRAY_BEGIN, key, None, depth)
+        yield
+        index = 0
+        for start, old, new in ranges:
+            if start > index:
+                self._output_elisions(context, start - index, subdepth)
+            for value in old:
+                yield (context, '', value, OP.REMOVE, subdepth)
+            for value in new:
+                yield (context, '', value, OP.ADD, subdepth)
+            index = start + len(old)
+        if length > index:
+            self._output_elisions(context, length - index, subdepth)
+        self._output(context, op, Part.ARRAY_END, key, None, depth)
+        yield
+
+    def _format_line(self, op: str, line: str) -> str:
+        """Prefixes an output line with its op and colorizes it if requested"""
+        line = f'{op}{line}'
+        if self.options.color:
+            theme = self._theme
+            if op in theme:
+                line = theme[op](line)
+        return line
+
+    def iter_lines(self, diff = None):
+        """
+        Generates human-readable diff text lines one by one while walking a dict of
+        differences created by Comparator, without holding the whole text in memory.
         """
         if diff is None:
             diff = self.diff
-        if opts is None:
-            opts = self.opts
 
-        if diff is None:
-            return ''
+        if diff is None or (type(diff) is Unchanged and diff.value is None):
+            # an unchanged null is None in the dict format too
+            return
 
-        output = []
+        lines = []
 
         def output_cb(op, line):
-            nonlocal output
+            lines.append(self._format_line(op, line))
 
-            line = f'{op}{line}'
-            if self._get_opt('color', False):
-                theme = self._get_opt('theme', Theme)
-                if op in theme:
-                    line = theme[op](line)
-            output.append(line)
+        yield from self._iter_output(self._output_diff({'output': output_cb}, '', diff), lines)
 
-        self._output_diff({'output': output_cb}, '', diff)
+    def write_to(self, stream, diff = None, buffer_lines = 1024) -> int:
+        """
+        Writes human-readable diff text lines to a text stream as they are produced,
+        in batches of buffer_lines lines. Returns the number of lines written.
+        """
+        count = 0
+        batch = []
+        for line in self.iter_lines(diff):
+            batch.append(line)
+            if len(batch) >= buffer_lines:
+                stream.write('\n'.join(batch) + '\n')
+                count += len(batch)
+                batch.clear()
+        if batch:
+            stream.write('\n'.join(batch) + '\n')
+            count += len(batch)
+        return count
 
-        return '\n'.join(output)
+    def stringify(self, diff = None, opts = None):
+        """
+        Produces a human-readable diff text lines from a dict of differences created by Comparator.
+        """
+        return '\n'.join(self.iter_lines(diff))
 
     def __str__(self):
         return self.stringify()
@@ -7,6 +7,8 @@ from .base import BaseFormatter, Part
 class JSONFormatter(BaseFormatter):
     def __init__(self, diff = None, opts = None):
         super().__init__(diff, opts)
+        indent_width = self.options.indent_width
+        self._indent_str = ' '*(indent_width if indent_width is not None else 2)
 
     def _output(self, context: Any, op: str, part: str, key: str, value: Any, depth: int):
         if op == OP.MODIFY:
@@ -15,8 +17,7 @@ class JSONFormatter(BaseFormatter):
             self._output(context, OP.ADD, part, key, value['__new'], depth)
             return
 
-        indent_str = ' '*self._get_opt('indent_width', 2)
-        indent = indent_str*depth
+        indent = self._indent_str*depth
         prefix = f'{key}: ' if key else ''
 
         output = context['output']
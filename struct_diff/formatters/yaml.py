@@ -10,6 +10,9 @@ class YAMLFormatter(BaseFormatter):
         # https://yaml.org/spec/1.2.2/#plain-style
         self.re_unsafe_str = re.compile(r'^([,\[\]{}#&*!|>\'"%@`\s]|[-?:]\s)')
         super().__init__(diff, opts)
+        indent_width = self.options.indent_width
+        self._indent_str = ' '*(indent_width if indent_width is not None else 1)
+        self._precision = self.options.precision
 
     def _text_diff(self, prev_val: str, cur_val: str, indent_str: str, depth: int) -> list[str]:
         """Creates a simplified unified diff and returns its string representation"""
@@ -31,7 +34,7 @@ class YAMLFormatter(BaseFormatter):
         if isinstance(val, int):
             return str(val)
         elif isinstance(val, float):
-            prec = self._get_opt('precision', None)
+            prec = self._precision
             return str(round(val, prec)) if prec is not None else str(val)
         else:
             s = str(val)
@@ -49,7 +52,7 @@ class YAMLFormatter(BaseFormatter):
                 self._output(context, OP.ADD, part, key, value['__new'], depth)
                 return
 
-        indent_str = ' '*self._get_opt('indent_width', 1)
+        indent_str = self._indent_str
         indent = indent_str*depth
         prefix = f'{key}: ' if key else ''
 
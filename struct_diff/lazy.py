@@ -0,0 +1,194 @@
+"""
+Lazily parsed JSON documents read from memory mapped files.
+
+Both files are mapped into memory instead of being read. Object members
+present in both documents are located by scanning the bytes and compared
+byte by byte first: identical members are not parsed at all, differing
+members that are large objects are split into members again and only
+the rest is parsed into Python objects.
+"""
+
+import json
+import mmap
+import re
+
+from .options import Options
+
+# objects larger than this many bytes are split into members instead of parsed
+LAZY_SPLIT_SIZE = 1 << 16
+# identical values shorter than this are parsed anyway
+LAZY_MIN_SIZE = 64
+# number of bytes compared at once
+_COMPARE_CHUNK_SIZE = 1 << 20
+
+_WS = re.compile(rb'[ \t\n\r]*')
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# skips strings and other characters up to the next bracket
+_BRACKET = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])', re.DOTALL)
+_SCALAR = re.compile(rb'[^,:\[\]{}" \t\n\r]+')
+_BOM = b'\xef\xbb\xbf'
+
+class LazyError(ValueError):
+    pass
+
+class _Identical(object):
+    """
+    Value of a member that is byte-identical in both documents. The same instance
+    is stored in both, so it compares equal to itself and to nothing else.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'IDENTICAL'
+
+    def __reduce__(self):
+        # unpickled as the module-level instance
+        return 'IDENTICAL'
+
+IDENTICAL = _Identical()
+
+def _skip_ws(buf, pos):
+    return _WS.match(buf, pos).end()
+
+def _value_end(buf, pos):
+    """ Return the end of the JSON value starting at pos, without parsing it """
+    c = buf[pos:pos+1]
+    if c == b'"':
+        m = _STRING.match(buf, pos)
+        if m is None:
+            raise LazyError(f'unterminated string at byte {pos}')
+        return m.end()
+    if c == b'{' or c == b'[':
+        depth = 0
+        while True:
+            m = _BRACKET.match(buf, pos)
+            if m is None:
+                raise LazyError(f'unterminated value at byte {pos}')
+            pos = m.end()
+            depth += 1 if m.group(1) in (b'{', b'[') else -1
+            if depth == 0:
+                return pos
+    m = _SCALAR.match(buf, pos)
+    if m is None:
+        raise LazyError(f'expected a value at byte {pos}')
+    return m.end()
+
+def _members(buf, start, end):
+    """ Return a dict of member spans (start, end) of the object between start and end by key """
+    pos = _skip_ws(buf, start + 1)
+    members = {}
+    if buf[pos:pos+1] == b'}':
+        return members
+    while True:
+        m = _STRING.match(buf, pos)
+        if m is None:
+            raise LazyError(f'expected an object key at byte {pos}')
+        key = json.loads(m.group())
+        pos = _skip_ws(buf, m.end())
+        if buf[pos:pos+1] != b':':
+            raise LazyError(f'expected \':\' at byte {pos}')
+        value_start = _skip_ws(buf, pos + 1)
+        value_end = _value_end(buf, value_start)
+        # like json.load, the last of duplicate keys wins
+        members[key] = (value_start, value_end)
+        pos = _skip_ws(buf, value_end)
+        c = buf[pos:pos+1]
+        if c == b'}':
+            if pos + 1 != end:
+                raise LazyError(f'unexpected data at byte {pos + 1}')
+            return members
+        if c != b',':
+            raise LazyError(f'expected \',\' or \'}}\' at byte {pos}')
+        pos = _skip_ws(buf, pos + 1)
+
+def _same_bytes(buf1, span1, buf2, span2):
+    start1, end1 = span1
+    start2, end2 = span2
+    if end1 - start1 != end2 - start2:
+        return False
+    for offset in range(0, end1 - start1, _COMPARE_CHUNK_SIZE):
+        size = min(_COMPARE_CHUNK_SIZE, end1 - start1 - offset)
+        if buf1[start1+offset:start1+offset+size] != buf2[start2+offset:start2+offset+size]:
+            return False
+    return True
+
+def _parse(buf, span):
+    return json.loads(buf[span[0]:span[1]])
+
+class _LazyLoader(object):
+
+    def __init__(self, buf1, buf2, keep_keys=(), unparsed=True):
+        self.buf1 = buf1
+        self.buf2 = buf2
+        self.keep_keys = keep_keys
+        self.unparsed = unparsed
+
+    def load(self, span1, span2):
+        """ Return the values between the spans of both documents as a tuple """
+        buf1, buf2 = self.buf1, self.buf2
+        if _same_bytes(buf1, span1, buf2, span2):
+            value = _parse(buf1, span1)
+            return value, value
+
+        if buf1[span1[0]:span1[0]+1] != b'{' or buf2[span2[0]:span2[0]+1] != b'{':
+            return _parse(buf1, span1), _parse(buf2, span2)
+        members1 = _members(buf1, *span1)
+        members2 = _members(buf2, *span2)
+
+        obj1 = {}
+        obj2 = {}
+        for key, span in members1.items():
+            if key not in members2:
+                obj1[key] = _parse(buf1, span)
+        for key, span in members2.items():
+            if key not in members1:
+                obj2[key] = _parse(buf2, span)
+        for key, member1 in members1.items():
+            member2 = members2.get(key)
+            if member2 is None:
+                continue
+            size = max(member1[1] - member1[0], member2[1] - member2[0])
+            if (self.unparsed and size >= LAZY_MIN_SIZE and key not in self.keep_keys
+                    and _same_bytes(buf1, member1, buf2, member2)):
+                obj1[key] = obj2[key] = IDENTICAL
+            elif size >= LAZY_SPLIT_SIZE:
+                obj1[key], obj2[key] = self.load(member1, member2)
+            else:
+                obj1[key], obj2[key] = _parse(buf1, member1), _parse(buf2, member2)
+        # member order is kept, like in the parsed documents
+        return ({ key: obj1[key] for key in members1 },
+                { key: obj2[key] for key in members2 })
+
+def _document_span(buf):
+    start = _skip_ws(buf, len(_BOM) if buf[:len(_BOM)] == _BOM else 0)
+    if start == len(buf):
+        raise LazyError('empty document')
+    end = _value_end(buf, start)
+    if _skip_ws(buf, end) != len(buf):
+        raise LazyError(f'unexpected data at byte {end}')
+    return start, end
+
+def load_pair(old_file, new_file, opts=None):
+    """
+    Load the documents of two binary files for comparing them with each other.
+    The files are memory mapped and members of objects identical in both documents
+    are replaced by IDENTICAL in both, or parsed once and shared when the options
+    need unchanged values in the diff (full, object_context, output_keys).
+    Identical members are not validated. Raises LazyError or ValueError if a
+    document is not valid JSON.
+    """
+    o = Options.of(opts)
+    with _map(old_file) as buf1, _map(new_file) as buf2:
+        loader = _LazyLoader(buf1, buf2, set(o.output_keys or ()), not (o.full or o.object_context))
+        span1 = _document_span(buf1)
+        span2 = _document_span(buf2)
+        if loader.unparsed and _same_bytes(buf1, span1, buf2, span2):
+            return IDENTICAL, IDENTICAL
+        return loader.load(span1, span2)
+
+def _map(file):
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # empty files cannot be mapped
+        raise LazyError('empty document')
@@ -0,0 +1,137 @@
+import math
+
+from .util import _get_opt, _compile_path_pattern, _PathFilter
+
+def _key_fields(fields):
+    if not fields:
+        return ()
+    if isinstance(fields, str):
+        return tuple(fields.split(','))
+    return tuple(fields)
+
+def _patterns(patterns):
+    if not patterns:
+        return ()
+    if isinstance(patterns, str):
+        return (patterns,)
+    return tuple(patterns)
+
+class Options(object):
+    """
+    Immutable snapshot of comparison and formatting options.
+
+    Options are resolved once from a dict, an argparse namespace or any object
+    with option attributes, so that hot loops read plain attributes instead of
+    looking options up by name. Missing or None options get their default values.
+    """
+
+    __slots__ = (
+        # comparison
+        'full', 'output_keys', 'output_new_only', 'object_context', 'keys_only',
+        'keep_unchanged_values', 'sort', 'precision', 'cache_size', 'structural_hash',
+        'array_key', 'array_key_paths', 'sequence_engine', 'typed',
+        'jobs', 'parallel_threshold', 'time_budget', 'op_budget',
+        'record_key', 'record_window', 'ignore', 'only', 'unordered', 'unordered_paths',
+        'numeric_arrays', 'abs_tolerance', 'rel_tolerance',
+        # instrumentation and summaries
+        'stats', 'stats_depth', 'summary', 'summary_depth',
+        # formatting
+        'color', 'theme', 'max_elisions', 'indent_width',
+        # derived from the options above
+        'array_key_patterns', 'path_filter', 'unordered_patterns',
+    )
+
+    _defaults = {
+        'full': False,
+        'output_keys': (),
+        'output_new_only': False,
+        'object_context': False,
+        'keys_only': False,
+        'keep_unchanged_values': False,
+        'sort': False,
+        'precision': None,
+        'cache_size': None,
+        'structural_hash': False,
+        'array_key': (),
+        'array_key_paths': {},
+        'sequence_engine': 'auto',
+        'typed': False,
+        # number of worker processes, 0 for one per CPU
+        'jobs': 1,
+        'parallel_threshold': 10000,
+        # seconds and number of object and array comparisons, None for unlimited
+        'time_budget': None,
+        'op_budget': None,
+        # fields aligning records of NDJSON files, records are aligned by position without them
+        'record_key': (),
+        # number of unmatched records held in memory before partitioning, see struct_diff.records
+        'record_window': 100000,
+        # path patterns of values not to compare and of the only values to compare, see _PathFilter
+        'ignore': (),
+        'only': (),
+        # compare all arrays or arrays at paths matching these patterns as multisets
+        'unordered': False,
+        'unordered_paths': (),
+        # compare arrays of numbers by position and report changed ranges, see RangeDelta;
+        # numbers in them are equal within the tolerances, which turn the option on
+        'numeric_arrays': False,
+        'abs_tolerance': None,
+        'rel_tolerance': None,
+        # count and time operations by the first stats_depth components of their path
+        'stats': False,
+        'stats_depth': 1,
+        # count changes by the first summary_depth components of their path instead of diffing, see summary()
+        'summary': False,
+        'summary_depth': 1,
+        'color': False,
+        'theme': None,
+        'max_elisions': math.inf,
+        # formatters have different default indentation
+        'indent_width': None,
+    }
+
+    def __init__(self, opts=None):
+        for name, default in self._defaults.items():
+            value = _get_opt(opts, name, None)
+            object.__setattr__(self, name, default if value is None else value)
+
+        output_keys = self.output_keys
+        if isinstance(output_keys, str):
+            output_keys = output_keys.split(',')
+        object.__setattr__(self, 'output_keys', frozenset(output_keys))
+        object.__setattr__(self, 'array_key', _key_fields(self.array_key))
+        object.__setattr__(self, 'record_key', _key_fields(self.record_key))
+        object.__setattr__(self, 'array_key_patterns', tuple(
+            (_compile_path_pattern(pattern), _key_fields(fields))
+            for pattern, fields in self.array_key_paths.items()
+        ))
+        object.__setattr__(self, 'ignore', _patterns(self.ignore))
+        object.__setattr__(self, 'only', _patterns(self.only))
+        object.__setattr__(self, 'unordered_patterns', tuple(
+            _compile_path_pattern(pattern) for pattern in _patterns(self.unordered_paths)
+        ))
+        object.__setattr__(self, 'path_filter',
+            _PathFilter(self.only, self.ignore) if self.ignore or self.only else None)
+
+    @classmethod
+    def of(cls, opts):
+        """ Return opts if it is already an Options instance, or a snapshot of it """
+        return opts if isinstance(opts, cls) else cls(opts)
+
+    def replace(self, **changes):
+        """ Return a copy of the snapshot with some options changed """
+        opts = { name: getattr(self, name) for name in self._defaults }
+        opts.update(changes)
+        return type(self)(opts)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return (type(self), ({ name: getattr(self, name) for name in self._defaults },))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({ {name: getattr(self, name) for name in self._defaults}!r})'
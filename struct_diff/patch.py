@@ -0,0 +1,148 @@
+"""
+Applying diffs produced by Comparator.
+
+patch() turns the old value into the new one and unpatch() the new value
+into the old one. Objects and arrays are modified in place, so large documents
+are not copied, values taken from the diff are inserted without copying.
+"""
+
+from .delta import Delta, to_dict
+from .formatters.base import _looks_like_diff
+from .util import OP, _is_ranges
+
+class PatchError(ValueError):
+    pass
+
+def _patch(value, diff, reverse):
+    if isinstance(diff, dict):
+        if ('__old' in diff) and ('__new' in diff) and (len(diff) == 2):
+            return diff['__old'] if reverse else diff['__new']
+        if isinstance(value, list) and _is_ranges(diff):
+            _patch_ranges(value, diff, reverse)
+            return value
+        if isinstance(value, dict):
+            _patch_object(value, diff, reverse)
+            return value
+    elif isinstance(diff, list):
+        if isinstance(value, list) and _looks_like_diff(diff):
+            _patch_array(value, diff, reverse)
+            return value
+    # a value included as it is (unchanged or with output_new_only)
+    return value if reverse else diff
+
+def _patch_object(obj, diff, reverse):
+    for key, value in diff.items():
+        if key.endswith('__deleted'):
+            key, remove = key[:-9], reverse is False
+        elif key.endswith('__added'):
+            key, remove = key[:-7], reverse is True
+        else:
+            if key in obj:
+                obj[key] = _patch(obj[key], value, reverse)
+            elif reverse:
+                raise PatchError(f'cannot unpatch key \'{key}\' missing from the object')
+            else:
+                obj[key] = value
+            continue
+
+        if remove:
+            if key not in obj:
+                raise PatchError(f'cannot remove key \'{key}\' missing from the object')
+            del obj[key]
+        else:
+            obj[key] = value
+
+def _patch_array(array, diff, reverse):
+    insert, remove = (OP.REMOVE, OP.ADD) if reverse else (OP.ADD, OP.REMOVE)
+    # elements moved from the old array by their index there, the old
+    # array is patched when not reverse and built from the result otherwise
+    sources = set()
+    returning = {}
+    if not reverse:
+        for item in diff:
+            if item[0] == OP.MOVE:
+                if item[1] >= len(array):
+                    raise PatchError(f'array has {len(array)} elements but the diff moves element {item[1]}')
+                sources.add(item[1])
+    result = []
+    index = 0
+    for item in diff:
+        op = item[0]
+        if op == insert:
+            result.append(item[1])
+            continue
+        if op == OP.MOVE and not reverse:
+            result.append(_patch_element(array[item[1]], item[2], reverse))
+            continue
+        while index in sources:
+            index += 1
+        if index >= len(array):
+            raise PatchError(f'array has {len(array)} elements but the diff refers to more')
+        if op == OP.MOVE:
+            returning[item[1]] = _patch_element(array[index], item[2], reverse)
+        elif op != remove:
+            result.append(_patch_element(array[index], item, reverse))
+        index += 1
+    while index in sources:
+        index += 1
+    if index != len(array):
+        raise PatchError(f'array has {len(array)} elements but the diff refers to {index}')
+    for source in sorted(returning):
+        if source > len(result):
+            raise PatchError(f'cannot move element back to index {source} of an array with {len(result)} elements')
+        result.insert(source, returning[source])
+    array[:] = result
+
+def _patch_element(value, item, reverse):
+    """ Apply an [OP.NONE] or [OP.MODIFY, diff] entry to an array element """
+    op = item[0]
+    if op == OP.NONE:
+        return value
+    if op == OP.MODIFY:
+        return _patch(value, item[1], reverse)
+    raise PatchError(f'unexpected op \'{op}\' in array diff')
+
+def _patch_ranges(array, diff, reverse):
+    length = diff['__length']
+    if reverse:
+        length += sum(len(new) - len(old) for _, old, new in diff['__ranges'])
+    if len(array) != length:
+        raise PatchError(f'array has {len(array)} elements but the diff refers to {length}')
+    result = []
+    index = 0
+    # starts are positions in the old array, shifted in the new one by earlier ranges
+    shift = 0
+    for start, old, new in diff['__ranges']:
+        remove, insert = (new, old) if reverse else (old, new)
+        if reverse:
+            start += shift
+            shift += len(new) - len(old)
+        result.extend(array[index:start])
+        result.extend(insert)
+        index = start + len(remove)
+    result.extend(array[index:])
+    array[:] = result
+
+def patch(obj, diff):
+    """
+    Apply a diff of obj to another value to obj and return the result. Objects and
+    arrays are patched in place, a replaced root value is only returned. Diffs made
+    with the sort or output_new_only options cannot be applied reliably.
+    Raises PatchError if obj does not match the structure of the diff.
+    """
+    if isinstance(diff, Delta):
+        diff = to_dict(diff)
+    if diff is None:
+        return obj
+    return _patch(obj, diff, False)
+
+def unpatch(obj, diff):
+    """
+    Revert a diff applied by patch() in place and return the original value,
+    see patch(). Diffs made with the keys_only option cannot be reverted.
+    """
+    if isinstance(diff, Delta):
+        diff = to_dict(diff)
+    if diff is None:
+        return obj
+    return _patch(obj, diff, True)
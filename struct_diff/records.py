@@ -0,0 +1,233 @@
+"""
+Comparison of newline-delimited JSON (NDJSON, JSON lines) files.
+
+Both files are read line by line, one JSON record per line. Records are aligned
+by the values of key fields or by their position and matched records are compared
+with a Comparator, so differences are produced while the files are read.
+
+Records waiting for a match are kept as text in a hash index by key. Once more than
+record_window records are waiting, the rest of both files is partitioned by the hash
+of the keys into temporary files and pairs of partitions are compared one at a time,
+so memory stays bounded however far apart matching records are.
+"""
+
+import json
+import tempfile
+from itertools import zip_longest
+
+from .comparator import OP, _round_copy
+from .stream import StreamComparator
+
+# number of partitions unmatched records are split into at once
+RECORD_PARTITIONS = 64
+# partitions still holding too many unmatched records are partitioned again,
+# up to this depth, after which they are compared in memory anyway
+_MAX_PARTITION_DEPTH = 3
+
+class RecordError(ValueError):
+    pass
+
+class _RecordReader(object):
+    """ Reader of records from the non-empty lines of a text file """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.name = getattr(fp, 'name', 'input')
+
+    def lines(self):
+        """ Iterate (line number, line) of non-empty lines """
+        for lineno, line in enumerate(self.fp, 1):
+            line = line.strip()
+            if lineno == 1:
+                line = line.lstrip('\ufeff')
+            if line:
+                yield lineno, line
+
+    def parse(self, lineno, line):
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise RecordError(f'{self.name}:{lineno}: {e}')
+
+    def elements(self):
+        """ Iterate parsed records, like elements of a JSON array """
+        for lineno, line in self.lines():
+            yield self.parse(lineno, line)
+
+def _entry_key(key):
+    """ Return the key of a diff entry of a record from its match key """
+    return ','.join(value if isinstance(value, str) else json.dumps(value) for value in json.loads(key))
+
+def _pop(index, key):
+    """ Remove and return the first line with key from an index of lines by key, None if there is none """
+    lines = index.get(key)
+    if lines is None:
+        return None
+    line = lines.pop(0)
+    if not lines:
+        del index[key]
+    return line
+
+def _partition_items(file):
+    """ Iterate (key, line, None) of the records written to a partition """
+    for line in file:
+        key, _, line = line.rstrip('\n').partition('\t')
+        yield key, line, None
+
+class RecordComparator(StreamComparator):
+    """
+    Compares two NDJSON files record by record.
+
+    With the record_key option, records are aligned by the values of their key fields
+    and reported like members of an object, keyed by the comma separated key values.
+    Records with duplicate keys are matched in the order they appear. Changed records
+    are reported as they are found and records without a match at the end. Once the
+    files are partitioned, records are reported in the order of the partitions.
+
+    Without record_key, records are aligned by position and reported like elements
+    of an array, so a record inserted in the middle changes all records after it.
+    """
+
+    def diff(self, old_file, new_file):
+        """
+        Start comparing two files, sets self.type to 'object' with the record_key option
+        or to 'array' otherwise and returns an iterator of diff entries like
+        StreamComparator.diff(). The iterator raises RecordError if a line is not
+        valid JSON or a record has no key fields.
+        """
+        self._start_budget()
+        reader1 = _RecordReader(old_file)
+        reader2 = _RecordReader(new_file)
+        if not self.options.record_key:
+            self.type = 'array'
+            return self._array_entries(reader1, reader2)
+        self.type = 'object'
+        return self._keyed_entries(reader1, reader2)
+
+    def _match_key(self, reader, lineno, record):
+        """ Return the values of the key fields of a record encoded as a string """
+        try:
+            values = [record[field] for field in self.options.record_key]
+        except (KeyError, TypeError):
+            raise RecordError(f'{reader.name}:{lineno}: record has no key field {", ".join(self.options.record_key)}')
+        if self.options.precision is not None:
+            values = _round_copy(values, self.options.precision)
+        return json.dumps(values, sort_keys=True)
+
+    def _keyed_items(self, reader):
+        """ Iterate (key, line, record) of the records of a file """
+        for lineno, line in reader.lines():
+            record = reader.parse(lineno, line)
+            yield self._match_key(reader, lineno, record), line, record
+
+    def _keyed_entries(self, reader1, reader2):
+        pending = ({}, {})
+        items1 = self._keyed_items(reader1)
+        items2 = self._keyed_items(reader2)
+        overflow = yield from self._match_records(pending, items1, items2, self._window())
+        if overflow:
+            yield from self._partitioned_entries(pending, items1, items2, 0)
+        else:
+            yield from self._unmatched_entries(pending)
+
+    def _match_records(self, pending, items1, items2, window):
+        """
+        Compare records with equal keys from two iterators of (key, line, record), where
+        record is None if the line was not parsed yet. Lines of records without a match
+        so far are kept in pending, a pair of indexes of lines by key of the old and
+        the new records. Stops and returns True once more than window records are
+        pending, returns False at the end of both iterators.
+        """
+        waiting = sum(len(lines) for index in pending for lines in index.values())
+        for item1, item2 in zip_longest(items1, items2):
+            for side, item in ((0, item1), (1, item2)):
+                if item is None:
+                    continue
+                key, line, record = item
+                match = _pop(pending[1 - side], key)
+                if match is None:
+                    pending[side].setdefault(key, []).append(line)
+                    waiting += 1
+                    continue
+                waiting -= 1
+                if record is None:
+                    record = json.loads(line)
+                other = json.loads(match)
+                if side == 0:
+                    yield from self._compare_records(key, record, other)
+                else:
+                    yield from self._compare_records(key, other, record)
+            if window is not None and waiting > window:
+                return True
+        return False
+
+    def _partitioned_entries(self, pending, items1, items2, depth, count=None):
+        """
+        Compare pending records and the remaining records of two iterators by partitions.
+        Records are written to temporary files by the hash of their key, so that records
+        with equal keys end up in the same pair of partitions, which is compared in memory
+        or partitioned again if it is still too large. count is the number of records
+        to partition if it is known, so that few records are not spread over many files.
+        """
+        window = self._window()
+        n = RECORD_PARTITIONS if count is None else max(2, min(RECORD_PARTITIONS, -(-count // window)))
+        partitions = ([], [])
+        counts = [0] * n
+        try:
+            for side, items in ((0, items1), (1, items2)):
+                files = partitions[side]
+                for _ in range(n):
+                    files.append(tempfile.TemporaryFile('w+', encoding='utf-8'))
+                for key, lines in pending[side].items():
+                    i = hash((depth, key)) % n
+                    for line in lines:
+                        files[i].write(f'{key}\t{line}\n')
+                    counts[i] += len(lines)
+                pending[side].clear()
+                for key, line, _ in items:
+                    i = hash((depth, key)) % n
+                    files[i].write(f'{key}\t{line}\n')
+                    counts[i] += 1
+
+            for i, (file1, file2) in enumerate(zip(*partitions)):
+                file1.seek(0)
+                file2.seek(0)
+                part = ({}, {})
+                part1 = _partition_items(file1)
+                part2 = _partition_items(file2)
+                # partitions with few records cannot overflow
+                large = counts[i] > window and depth < _MAX_PARTITION_DEPTH
+                overflow = yield from self._match_records(part, part1, part2, window if large else None)
+                if overflow:
+                    yield from self._partitioned_entries(part, part1, part2, depth + 1, counts[i])
+                else:
+                    yield from self._unmatched_entries(part)
+                file1.close()
+                file2.close()
+        finally:
+            for file in partitions[0] + partitions[1]:
+                file.close()
+
+    def _window(self):
+        return max(1, self.options.record_window)
+
+    def _compare_records(self, key, record1, record2):
+        change = self._compare('[]', record1, record2)
+        if not change['equal']:
+            self.equal = False
+            yield OP.NONE, _entry_key(key), change['result']
+        elif self.options.full:
+            yield OP.NONE, _entry_key(key), self._round(record1)
+
+    def _unmatched_entries(self, pending):
+        """ Report records left in pending as deleted or added """
+        new_only = self.options.output_new_only
+        if not new_only:
+            for key, lines in pending[0].items():
+                for line in lines:
+                    self.equal = False
+                    yield OP.REMOVE, _entry_key(key), self._round(json.loads(line))
+        for key, lines in pending[1].items():
+            for line in lines:
+                self.equal = False
+                yield OP.NONE if new_only else OP.ADD, _entry_key(key), self._round(json.loads(line))
@@ -0,0 +1,295 @@
+"""
+Long-running diff server answering requests over a local socket.
+
+Clients connect to a Unix socket or a TCP port on a loopback host and send one JSON
+request per line, the server answers each with one JSON response per line.
+Parsed files, Baselines of old documents and responses are kept in LRU caches
+shared by all requests and clients, so repeated comparisons pay neither the
+interpreter startup nor parsing and indexing the same documents again.
+Requests are served by a pool of worker threads, so the event loop keeps
+accepting clients while documents are parsed and compared.
+
+A request is an object with the members:
+
+    id          any value, returned in the response
+    old, new    inline documents, or
+    old_path, new_path
+                paths of JSON files read by the server
+    old_key, new_key
+                optional strings identifying inline documents, so that they are
+                cached like files; a client must use another key once a document
+                changes
+    options     optional object of options, like the options of diff()
+    format      'raw' (default) for the diff as JSON, 'json' or 'yaml' for
+                the text produced by JSONFormatter or YAMLFormatter
+
+and the response is {id, equal, diff or output, approximated}, or {id, error}
+if the request failed.
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .baseline import Baseline
+from .comparator import Comparator
+from .delta import Delta, to_dict
+from .formatters import JSONFormatter, YAMLFormatter
+from .options import Options
+from .util import _LRUCache
+
+# number of worker threads serving requests
+SERVER_WORKERS = 4
+# numbers of parsed files, baselines and responses kept between requests
+DOCUMENT_CACHE_SIZE = 64
+BASELINE_CACHE_SIZE = 16
+RESULT_CACHE_SIZE = 256
+# longest request line accepted, including inline documents
+MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+FORMATTERS = { 'json': JSONFormatter, 'yaml': YAMLFormatter }
+
+_MISSING = object()
+
+class RequestError(ValueError):
+    pass
+
+def _parse_address(address):
+    """ Return (host, port) of a [HOST:]PORT address, or (None, None) for a path of a Unix socket """
+    host, _, port = address.rpartition(':')
+    if port.isdigit() and '/' not in address:
+        return host or '127.0.0.1', int(port)
+    return None, None
+
+def check_address(address):
+    """
+    Raise ValueError unless address is a path of a Unix socket or a port on a loopback
+    host. Requests can read any file the server can open, so it must not be reachable
+    from other machines.
+    """
+    host, port = _parse_address(address)
+    if port is None or host == 'localhost':
+        return
+    try:
+        loopback = ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f'cannot serve on {host}, requests can read files of the server, '
+                         f'use a Unix socket or a loopback host like 127.0.0.1, ::1 or localhost')
+
+class DiffServer(object):
+    """
+    Answers diff requests, see the module documentation. The caches are shared by
+    all worker threads and guarded by a lock. Cached documents and baselines are
+    never modified, so the same ones are compared by many threads at once.
+    """
+
+    def __init__(self, workers=SERVER_WORKERS, document_cache_size=DOCUMENT_CACHE_SIZE,
+                 baseline_cache_size=BASELINE_CACHE_SIZE, result_cache_size=RESULT_CACHE_SIZE):
+        self.workers = workers
+        # parsed documents by path, modification time and size, or by client key
+        self._documents = _LRUCache(document_cache_size)
+        # baselines by the key of their document and the options
+        self._baselines = _LRUCache(baseline_cache_size)
+        # responses by the keys of both documents, the options and the format
+        self._results = _LRUCache(result_cache_size)
+        self._lock = threading.Lock()
+
+    def cache_info(self):
+        """ Return the cache_info() of the document, baseline and response caches """
+        with self._lock:
+            return { 'documents': self._documents.info(), 'baselines': self._baselines.info(),
+                     'results': self._results.info() }
+
+    def handle(self, line):
+        """ Answer a request line, returns the response line. Runs in a worker thread. """
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                raise RequestError(f'invalid request: {e}')
+            if not isinstance(request, dict):
+                raise RequestError('a request must be a JSON object')
+            request_id = request.get('id')
+            response = { 'id': request_id }
+            response.update(self.respond(request))
+        except (RequestError, OSError) as e:
+            response = { 'id': request_id, 'error': str(e) }
+        except Exception as e:
+            # a failed request must not stop the server
+            response = { 'id': request_id, 'error': f'{type(e).__name__}: {e}' }
+        return (json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def respond(self, request):
+        """ Compare the documents of a request dict and return the response without its id """
+        fmt = request.get('format', 'raw')
+        if fmt != 'raw' and fmt not in FORMATTERS:
+            raise RequestError(f'unknown format \'{fmt}\', expected raw, {", ".join(FORMATTERS)}')
+        opts = request.get('options') or {}
+        if not isinstance(opts, dict):
+            raise RequestError('options must be a JSON object')
+        options = Options(opts)
+        options_key = json.dumps(opts, sort_keys=True)
+
+        old, old_key = self._document(request, 'old')
+        new, new_key = self._document(request, 'new')
+        result_key = None
+        if old_key is not None and new_key is not None:
+            result_key = (old_key, new_key, options_key, fmt)
+            with self._lock:
+                response = self._results.get(result_key)
+            if response is not None:
+                return response
+
+        if old_key is not None:
+            baseline = self._baseline(old, (old_key, options_key), options)
+            comparator = baseline.comparator()
+            # the baseline indexed the cached document, which is equal to old
+            old = baseline.obj
+        else:
+            comparator = Comparator(options)
+        change = comparator.diff(old, new)
+
+        result = change['result']
+        response = { 'equal': change['equal'] }
+        if fmt == 'raw':
+            response['diff'] = to_dict(result, options.output_new_only) if isinstance(result, Delta) else result
+        else:
+            response['output'] = FORMATTERS[fmt](result, options).stringify() if result is not None else ''
+        response['approximated'] = comparator.approximated
+
+        if result_key is not None:
+            with self._lock:
+                self._results.put(result_key, response)
+        return response
+
+    def _document(self, request, side):
+        """ Return the old or new document of a request and its cache key, None for inline documents without a key """
+        if side in request:
+            key = request.get(f'{side}_key')
+            if key is None:
+                return request[side], None
+            if not isinstance(key, str):
+                raise RequestError(f'{side}_key must be a string')
+            key = ('key', key)
+            with self._lock:
+                doc = self._documents.get(key, _MISSING)
+                if doc is _MISSING:
+                    doc = request[side]
+                    self._documents.put(key, doc)
+            return doc, key
+
+        path = request.get(f'{side}_path')
+        if path is None:
+            raise RequestError(f'request has neither {side} nor {side}_path')
+        if not isinstance(path, str):
+            raise RequestError(f'{side}_path must be a string')
+        st = os.stat(path)
+        key = ('path', os.path.realpath(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            doc = self._documents.get(key, _MISSING)
+        if doc is _MISSING:
+            with open(path) as f:
+                try:
+                    doc = json.load(f)
+                except ValueError as e:
+                    raise RequestError(f'error parsing file {path} as JSON: {e}')
+            with self._lock:
+                self._documents.put(key, doc)
+        return doc, key
+
+    def _baseline(self, doc, key, options):
+        with self._lock:
+            baseline = self._baselines.get(key)
+        if baseline is None:
+            # built outside of the lock, a baseline built twice at once is only wasted work
+            baseline = Baseline(doc, options)
+            with self._lock:
+                self._baselines.put(key, baseline)
+        return baseline
+
+    async def serve(self, address, ready=None):
+        """
+        Serve clients on address, a path of a Unix socket or [HOST:]PORT of a TCP port
+        on localhost by default, until cancelled or SIGTERM. ready is called once
+        the server accepts connections. Raises ValueError if HOST is not a loopback
+        host, see check_address().
+        """
+        check_address(address)
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(self.workers)
+
+        async def client(reader, writer):
+            try:
+                while True:
+                    try:
+                        line = await reader.readline()
+                    except ValueError:
+                        # longer than MAX_REQUEST_SIZE, the rest of the line cannot be skipped
+                        writer.write((json.dumps({ 'id': None, 'error': 'request too long' }) + '\n').encode('utf-8'))
+                        break
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    writer.write(await loop.run_in_executor(executor, self.handle, line))
+                    await writer.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                # clients are disconnected when the server stops
+                pass
+            finally:
+                writer.close()
+
+        host, port = _parse_address(address)
+        if port is None:
+            server = await asyncio.start_unix_server(client, path=address, limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(client, host, port, limit=MAX_REQUEST_SIZE)
+        try:
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            executor.shutdown(wait=False)
+            if port is None and os.path.exists(address):
+                os.unlink(address)
+
+def serve(address, workers=SERVER_WORKERS):
+    """ Run a DiffServer on address until interrupted, see DiffServer.serve() """
+    try:
+        asyncio.run(DiffServer(workers).serve(address))
+    except KeyboardInterrupt:
+        pass
+
+def request(address, **fields):
+    """
+    Send a request to a server on address and return its response, a blocking
+    client for Python programs; fields are the members of the request
+    """
+    host, port = _parse_address(address)
+    if port is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection((host, port))
+    with sock, sock.makefile('rwb') as f:
+        f.write((json.dumps(fields, ensure_ascii=False) + '\n').encode('utf-8'))
+        f.flush()
+        line = f.readline()
+    if not line:
+        raise ConnectionError(f'no response from {address}')
+    return json.loads(line)
@@ -0,0 +1,76 @@
+"""
+Counters and timers of comparisons and formatting by path.
+
+A Stats instance is kept by a Comparator or a formatter when the stats
+option is set. Operations are counted by name and by the first stats_depth
+components of the path they work on, together with their cumulative time.
+"""
+
+import time
+
+from .util import _format_path
+
+class Stats(object):
+    """
+    Counts and cumulative seconds of operations by (name, path prefix).
+
+    The time of an operation includes the operations nested in it, like the
+    cumulative time of a profiler, but an operation nested in another one with
+    the same name and prefix is only counted, so its time is not added twice.
+    """
+
+    def __init__(self, depth=1):
+        self.depth = depth
+        # [count, seconds] by (name, prefix)
+        self._entries = {}
+        # number of running operations by (name, prefix)
+        self._running = {}
+
+    def prefix(self, path):
+        """ Return the prefix of a list of path components operations are grouped by """
+        return _format_path(path[:self.depth])
+
+    def start(self, name, path):
+        """ Start timing an operation on the value at path, returns a token for stop() """
+        key = (name, self.prefix(path))
+        self._running[key] = self._running.get(key, 0) + 1
+        return key, time.perf_counter()
+
+    def stop(self, token, count=1):
+        """ Stop timing an operation started by start() and count it count times """
+        key, start = token
+        running = self._running[key] - 1
+        self._running[key] = running
+        entry = self._entries.setdefault(key, [0, 0.0])
+        entry[0] += count
+        if running == 0:
+            entry[1] += time.perf_counter() - start
+
+    def add(self, name, prefix, seconds, count=1):
+        """ Add count operations taking seconds in total to the entry of name and prefix """
+        entry = self._entries.setdefault((name, prefix), [0, 0.0])
+        entry[0] += count
+        entry[1] += seconds
+
+    def merge(self, other):
+        """ Add all counts and times of another Stats, e.g. from a worker process """
+        for (name, prefix), (count, seconds) in other._entries.items():
+            self.add(name, prefix, seconds, count)
+
+    def as_dict(self):
+        """ Return {name: {prefix: {'count': count, 'time': seconds}}} """
+        result = {}
+        for (name, prefix), (count, seconds) in sorted(self._entries.items()):
+            result.setdefault(name, {})[prefix] = { 'count': count, 'time': seconds }
+        return result
+
+    def format(self):
+        """ Return a table of all entries, the slowest first """
+        rows = sorted(self._entries.items(), key=lambda entry: (-entry[1][1], entry[0]))
+        lines = [f'{"operation":<16} {"count":>10} {"time":>10}  path']
+        for (name, prefix), (count, seconds) in rows:
+            lines.append(f'{name:<16} {count:>10} {seconds:>9.3f}s  {prefix or "(root)"}')
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.as_dict()!r})'
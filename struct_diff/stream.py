@@ -0,0 +1,328 @@
+"""
+Streaming comparison of large JSON documents.
+
+Both documents are parsed incrementally, one top-level object member or array
+element at a time, so only the members being compared are held in memory.
+"""
+
+import json
+import re
+import time
+from itertools import zip_longest
+
+from .comparator import Comparator, OP
+from .stats import Stats
+from .formatters.base import Part
+from .options import Options
+from .delta import Delta, to_dict
+from .util import _round_obj, _is_scalar
+
+# number of characters read from a file at once
+STREAM_CHUNK_SIZE = 1 << 16
+
+_NUMBER_CHARS = '0123456789.eE+-'
+_WS = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+_MISSING = object()
+
+class StreamError(ValueError):
+    pass
+
+class _JSONReader(object):
+    """ Incremental reader of JSON values from a text file """
+
+    def __init__(self, fp, chunk_size=STREAM_CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read_more(self):
+        # read at least as much as is pending, so a large value is
+        # re-parsed only a logarithmic number of times
+        data = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+        return bool(data)
+
+    def _skip_ws(self):
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._read_more():
+                return
+
+    def peek(self):
+        self._skip_ws()
+        return self.buf[self.pos:self.pos+1]
+
+    def take(self, expected):
+        c = self.peek()
+        if c == '' or c not in expected:
+            raise StreamError(f'expected one of {expected!r} but found {c!r} in {getattr(self.fp, "name", "input")}')
+        self.pos += 1
+        return c
+
+    def value(self):
+        self._skip_ws()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            if not self.eof and isinstance(value, (int, float)) and \
+                (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS) and self._read_more():
+                # the number may continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+    def start(self):
+        """ Consume the opening bracket and return 'object' or 'array', None for other values """
+        c = self.peek()
+        if c == '{':
+            self.pos += 1
+            return 'object'
+        elif c == '[':
+            self.pos += 1
+            return 'array'
+        return None
+
+    def members(self):
+        """ Iterate (key, value) members of an object following start() """
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise StreamError(f'expected object key but found {key!r}')
+            self.take(':')
+            yield key, self.value()
+            if self.take(',}') == '}':
+                return
+
+    def elements(self):
+        """ Iterate elements of an array following start() """
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.take(',]') == ']':
+                return
+
+class StreamComparator(object):
+    """
+    Compares two JSON documents read from text files member by member.
+
+    Object members are compared as soon as both documents contained them,
+    members missing from the other document are reported at the end.
+    Array elements are compared by position.
+    """
+
+    def __init__(self, opts=None):
+        self.opts = opts
+        self.options = Options.of(opts)
+        self.type = None
+        self.equal = True
+        # paths compared approximately, see Comparator.approximated
+        self.approximated = []
+        # budget counters carried over from the comparator of the previous member
+        self._budget = None
+        # counts and times of all members with the stats option, see Comparator.stats
+        self.stats = Stats(self.options.stats_depth) if self.options.stats else None
+
+    def _round(self, value):
+        p = self.options.precision
+        return _round_obj(value, p) if p is not None else value
+
+    def _compare(self, path, value1, value2):
+        # a comparator per member, so its cache does not keep compared members alive
+        comparator = Comparator(self.options)
+        if self._budget is not None:
+            comparator._ops, comparator._exhausted, comparator._deadline = self._budget
+        comparator._path.append(path)
+        change = comparator.diff(value1, value2)
+        self._budget = comparator._ops, comparator._exhausted, comparator._deadline
+        self.approximated.extend(comparator.approximated)
+        if self.stats is not None:
+            self.stats.merge(comparator.stats)
+        return change
+
+    def _compared(self, members):
+        """ Filter (key, value) members of the root object excluded by the ignore and only options """
+        path_filter = self.options.path_filter
+        if path_filter is None:
+            return members
+        root = path_filter.root
+        return (member for member in members if path_filter.allowed(path_filter.step(root, member[0])))
+
+    def _start_budget(self):
+        """ Start counting the time_budget and op_budget shared by all members from now """
+        t = self.options.time_budget
+        self._budget = 0, False, time.monotonic() + t if t is not None else None
+
+    def diff(self, old_file, new_file):
+        """
+        Start comparing two documents, sets self.type to 'object' or 'array' and
+        returns an iterator of diff entries. Object entries are (op, key, value) tuples
+        where op is OP.REMOVE for deleted keys, OP.ADD for added keys and OP.NONE
+        for changed or unchanged keys. Array entries are [op, value] lists of the same
+        form as array diffs produced by Comparator.
+        Raises StreamError if the documents are not two objects or two arrays.
+        """
+        self._start_budget()
+        reader1 = _JSONReader(old_file)
+        reader2 = _JSONReader(new_file)
+        type1 = reader1.start()
+        type2 = reader2.start()
+        if type1 is None or type1 != type2:
+            raise StreamError('only two objects or two arrays can be compared as a stream')
+        self.type = type1
+        if self.type == 'object':
+            return self._object_entries(reader1, reader2)
+        return self._array_entries(reader1, reader2)
+
+    def _object_entries(self, reader1, reader2):
+        new_only = self.options.output_new_only
+        full = self.options.full
+        output_keys = self.options.output_keys
+        pending1 = {}
+        pending2 = {}
+        members1 = self._compared(reader1.members())
+        members2 = self._compared(reader2.members())
+
+        for member1, member2 in zip_longest(members1, members2):
+            pairs = []
+            if member1 is not None:
+                key, value1 = member1
+                if key in pending2:
+                    pairs.append((key, value1, pending2.pop(key)))
+                else:
+                    pending1[key] = value1
+            if member2 is not None:
+                key, value2 = member2
+                if key in pending1:
+                    pairs.append((key, pending1.pop(key), value2))
+                else:
+                    pending2[key] = value2
+
+            for key, value1, value2 in pairs:
+                change = self._compare(key, value1, value2)
+                if not change['equal']:
+                    self.equal = False
+                    yield OP.NONE, key, change['result']
+                elif full or key in output_keys:
+                    yield OP.NONE, key, self._round(value1)
+
+        if not new_only:
+            for key, value1 in pending1.items():
+                self.equal = False
+                yield OP.REMOVE, key, self._round(value1)
+        for key, value2 in pending2.items():
+            self.equal = False
+            yield OP.NONE if new_only else OP.ADD, key, self._round(value2)
+
+    def _array_entries(self, reader1, reader2):
+        keep_unchanged = self.options.full or self.options.keep_unchanged_values
+        path_filter = self.options.path_filter
+        if path_filter is not None and not path_filter.allowed(path_filter.step(path_filter.root, '[]')):
+            # elements are excluded, the arrays are equal
+            return
+
+        for item1, item2 in zip_longest(reader1.elements(), reader2.elements(), fillvalue=_MISSING):
+            if item2 is _MISSING:
+                self.equal = False
+                yield [OP.REMOVE, self._round(item1)]
+            elif item1 is _MISSING:
+                self.equal = False
+                yield [OP.ADD, self._round(item2)]
+            else:
+                change = self._compare('[]', item1, item2)
+                if change['equal']:
+                    yield [OP.NONE, self._round(item1)] if keep_unchanged else [OP.NONE]
+                elif not _is_scalar(item1) and type(item1) == type(item2):
+                    self.equal = False
+                    yield [OP.MODIFY, change['result']]
+                else:
+                    self.equal = False
+                    yield [OP.REMOVE, self._round(item1)]
+                    yield [OP.ADD, self._round(item2)]
+
+def iter_stream_lines(comparator: StreamComparator, entries, formatter):
+    """
+    Formats entries of a StreamComparator with a formatter, yielding
+    output lines as soon as they are formatted.
+    """
+    lines = []
+    context = {'output': lambda op, line: lines.append(formatter._format_line(op, line))}
+    if comparator.type == 'object':
+        begin, end = Part.OBJECT_BEGIN, Part.OBJECT_END
+    else:
+        begin, end = Part.ARRAY_BEGIN, Part.ARRAY_END
+
+    started = False
+    elision_count = 0
+    for entry in entries:
+        if comparator.type == 'object':
+            op, key, value = entry
+        else:
+            op, key, value = entry[0], '', entry[1] if len(entry) > 1 else None
+            if op == OP.NONE and len(entry) == 1:
+                elision_count += 1
+                continue
+            if op == OP.MODIFY:
+                op = OP.NONE
+
+        if not started:
+            formatter._output(context, OP.NONE, begin, '', None, 0)
+            started = True
+        if elision_count > 0:
+            formatter._output_elisions(context, elision_count, 1)
+            elision_count = 0
+        yield from formatter._iter_output(formatter._output_diff(context, key, value, op, 1), lines)
+        yield from lines
+        lines.clear()
+
+    if started:
+        formatter._output(context, OP.NONE, end, '', None, 0)
+        yield from lines
+
+def iter_stream_json(comparator: StreamComparator, entries):
+    """
+    Encodes entries of a StreamComparator as the JSON diff document,
+    yielding chunks of text as soon as each entry is encoded.
+    """
+    opening, closing = ('{', '}') if comparator.type == 'object' else ('[', ']')
+    new_only = comparator.options.output_new_only
+    started = False
+    elisions = []
+    for entry in entries:
+        if comparator.type == 'object':
+            op, key, value = entry
+            if isinstance(value, Delta):
+                value = to_dict(value, new_only)
+            if op == OP.REMOVE:
+                key += '__deleted'
+            elif op == OP.ADD:
+                key += '__added'
+            text = json.dumps(key, ensure_ascii=False) + ': ' + json.dumps(value, indent=2, ensure_ascii=False)
+        else:
+            if len(entry) > 1 and isinstance(entry[1], Delta):
+                entry = [entry[0], to_dict(entry[1], new_only)]
+            if entry[0] == OP.NONE and len(entry) == 1 and not started:
+                # hold leading unchanged elements until there is a change
+                elisions.append(entry)
+                continue
+            text = ',\n'.join(json.dumps(e, indent=2, ensure_ascii=False) for e in elisions + [entry])
+            elisions = []
+        text = '\n'.join('  ' + line for line in text.split('\n'))
+        yield (',\n' if started else opening + '\n') + text
+        started = True
+
+    yield ('\n' + closing if started else 'null') + '\n'
@@ -0,0 +1,61 @@
+"""
+Numbers of changes between two documents by path prefix.
+
+A Summary is what summary() returns instead of a diff: how many values
+were added, removed and modified under each of the first summary_depth
+components of their paths.
+"""
+
+ADDED = 0
+REMOVED = 1
+MODIFIED = 2
+
+class Summary(dict):
+    """
+    Numbers of changes by path prefix, a dict of [added, removed, modified]
+    lists by prefix. A value moved within an array is removed and added, or modified
+    when the array is aligned by keys, a scalar replaced by another scalar or a value
+    of a different type is modified.
+    """
+
+    def count(self, prefix, kind, n=1):
+        counts = self.get(prefix)
+        if counts is None:
+            counts = self[prefix] = [0, 0, 0]
+        counts[kind] += n
+
+    def merge(self, other):
+        """ Add the counts of another Summary """
+        for prefix, counts in other.items():
+            mine = self.get(prefix)
+            if mine is None:
+                self[prefix] = list(counts)
+            else:
+                mine[ADDED] += counts[ADDED]
+                mine[REMOVED] += counts[REMOVED]
+                mine[MODIFIED] += counts[MODIFIED]
+
+    def total(self):
+        """ Return the numbers of added, removed and modified values under all prefixes """
+        added = removed = modified = 0
+        for counts in self.values():
+            added += counts[ADDED]
+            removed += counts[REMOVED]
+            modified += counts[MODIFIED]
+        return added, removed, modified
+
+    def as_dict(self):
+        """ Return {prefix: {'added': n, 'removed': n, 'modified': n}} """
+        return { prefix: { 'added': counts[ADDED], 'removed': counts[REMOVED], 'modified': counts[MODIFIED] }
+                 for prefix, counts in sorted(self.items()) }
+
+    def format(self):
+        """ Return a line with the counts of every prefix followed by a line with the totals """
+        lines = []
+        width = max((len(prefix) for prefix in self), default=0)
+        width = max(width, len('(root)'))
+        for prefix, (added, removed, modified) in sorted(self.items()):
+            lines.append(f' {prefix or "(root)":<{width}} | +{added} -{removed} ~{modified}')
+        added, removed, modified = self.total()
+        lines.append(f' {added + removed + modified} changes, {added} added, {removed} removed, {modified} modified')
+        return '\n'.join(lines)
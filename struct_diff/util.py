@@ -1,4 +1,13 @@
 import math
+import re
+from collections import OrderedDict
+
+class OP:
+    NONE = ' '
+    ADD = '+'
+    REMOVE = '-'
+    MODIFY = '~'
+    MOVE = '>'
 
 def _is_scalar(value):
     """
@@ -30,18 +39,253 @@ def _extend_typeof(obj):
     else:
 	    return type(obj).__name__
 
+def _format_path(path) -> str:
+    """
+    Formats a list of path components as a string.
+    Object keys are separated by dots, array elements are denoted by [].
+    """
+    s = ''
+    for component in path:
+        if component == '[]':
+            s += '[]'
+        elif s:
+            s += '.' + str(component)
+        else:
+            s = str(component)
+    return s
+
+def _compile_path_pattern(pattern: str):
+    """
+    Compiles a path pattern into a regular expression matching
+    paths formatted by _format_path. A * matches any part of a single
+    key, ** matches any number of keys and array levels.
+    """
+    regex = ''
+    for token in re.split(r'(\*\*|\*)', pattern):
+        if token == '**':
+            regex += '.*'
+        elif token == '*':
+            regex += r'[^.\[]*'
+        else:
+            regex += re.escape(token)
+    return re.compile(regex + r'\Z')
+
+def _path_components(pattern: str):
+    """
+    Splits a path pattern into components: object keys, [] for array elements,
+    * within a key and ** for any number of keys and array levels.
+    JSONPath-style $. prefixes and [*] are accepted too.
+    """
+    if pattern.startswith('$'):
+        pattern = pattern[1:].lstrip('.')
+    return re.findall(r'\[\]|[^.\[\]]+', pattern.replace('[*]', '[]'))
+
+class _TrieNode(object):
+    __slots__ = ('children', 'globs', 'deep', 'loop', 'end')
+
+    def __init__(self, loop=False):
+        # nodes by exact component, (regex, node) pairs of components with *
+        self.children = {}
+        self.globs = []
+        # node of a ** component following this one
+        self.deep = None
+        # a ** node matches any number of components
+        self.loop = loop
+        # a pattern ends here
+        self.end = False
+
+def _compile_trie(patterns):
+    """ Compiles path patterns into a trie of their components, returns its root """
+    root = _TrieNode()
+    for pattern in patterns:
+        node = root
+        for component in _path_components(pattern):
+            if component == '**':
+                if node.deep is None:
+                    node.deep = _TrieNode(loop=True)
+                node = node.deep
+            elif '*' in component:
+                regex = '.*'.join(re.escape(part) for part in component.split('*'))
+                for glob, child in node.globs:
+                    if glob.pattern == regex:
+                        break
+                else:
+                    child = _TrieNode()
+                    node.globs.append((re.compile(regex, re.DOTALL), child))
+                node = child
+            else:
+                node = node.children.setdefault(component, _TrieNode())
+        node.end = True
+    return root
+
+def _trie_closure(nodes):
+    """ Adds ** nodes following the nodes, as ** matches no components too """
+    result = []
+    for node in nodes:
+        while node is not None and node not in result:
+            result.append(node)
+            node = node.deep
+    return tuple(result)
+
+def _trie_step(nodes, component):
+    """ Returns the trie nodes reached from nodes by a path component """
+    result = []
+    for node in nodes:
+        if node.loop:
+            result.append(node)
+        child = node.children.get(component)
+        if child is not None:
+            result.append(child)
+        # * matches within an object key, not array levels
+        if node.globs and component != '[]':
+            for glob, child in node.globs:
+                if glob.fullmatch(component):
+                    result.append(child)
+    return _trie_closure(result)
+
+class _PathFilter(object):
+    """
+    Include and exclude path patterns compiled into tries of path components, so
+    that all patterns are matched at once while descending into a document.
+    The state of a path is a pair of tuples of the include and exclude trie nodes
+    reached by it. Include nodes are None once the path matched an include pattern,
+    as everything below it is included; an empty tuple means no include pattern can
+    match the path or anything below it.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        include_nodes = _trie_closure([_compile_trie(include)]) if include else None
+        if include_nodes is not None and any(node.end for node in include_nodes):
+            include_nodes = None
+        self.root = (include_nodes, _trie_closure([_compile_trie(exclude)]) if exclude else ())
+
+    def state(self, path):
+        """ Returns the state of a list of path components """
+        state = self.root
+        for component in path:
+            state = self.step(state, component)
+        return state
+
+    def step(self, state, component):
+        """ Returns the state of a path extended by a component """
+        include, exclude = state
+        if include:
+            include = _trie_step(include, component)
+            if any(node.end for node in include):
+                include = None
+        if exclude:
+            exclude = _trie_step(exclude, component)
+        return include, exclude
+
+    @staticmethod
+    def allowed(state):
+        """ Returns True if the value at a path in the state is compared """
+        include, exclude = state
+        return include != () and not any(node.end for node in exclude)
+
+    def members(self, obj, state):
+        """ Returns obj without the members excluded in the state of its path """
+        if state[0] is None and not state[1]:
+            # nothing below can be excluded
+            return obj
+        allowed = self.allowed
+        step = self.step
+        excluded = [key for key in obj if not allowed(step(state, key))]
+        if not excluded:
+            return obj
+        return { key: value for key, value in obj.items() if key not in excluded }
+
 def _round_obj(data, precision):
+    """
+    Rounds floats in data to precision decimal places. Objects are
+    modified in place, arrays are copied. Uses an explicit stack,
+    so data can be nested to any depth.
+    """
     if isinstance(data, list):
-        return [_round_obj(i, precision) for i in data]
-    elif isinstance(data, dict):
-        for k in data:
-            data[k] = _round_obj(data[k], precision)
-        return data
-    elif isinstance(data, float) and math.isfinite(data):
-        return round(data, precision)
-    else:
+        data = list(data)
+    elif not isinstance(data, dict):
+        if isinstance(data, float) and math.isfinite(data):
+            return round(data, precision)
         return data
 
+    stack = [data]
+    while stack:
+        container = stack.pop()
+        items = container.items() if isinstance(container, dict) else enumerate(container)
+        for k, value in items:
+            if isinstance(value, list):
+                value = list(value)
+                container[k] = value
+                stack.append(value)
+            elif isinstance(value, dict):
+                stack.append(value)
+            elif isinstance(value, float) and math.isfinite(value):
+                container[k] = round(value, precision)
+    return data
+
+def _is_ranges(diff):
+    """ Returns True if a dict diff is a {__length, __ranges} diff of an array of numbers """
+    return len(diff) == 2 and '__ranges' in diff and '__length' in diff
+
+def _round_scalar(value, precision):
+    """ Rounds a finite float to precision decimal places, other values are returned as they are """
+    if isinstance(value, float) and math.isfinite(value):
+        return round(value, precision)
+    return value
+
+def _equal(a, b, precision=None):
+    """
+    Returns a == b for nested objects and arrays, with floats rounded to precision
+    decimal places if it is not None. Comparing deeply nested values with == exceeds
+    the recursion limit, they are compared with an explicit stack instead.
+    """
+    try:
+        # values equal without rounding are equal rounded too
+        if a == b:
+            return True
+        if precision is None:
+            return False
+    except RecursionError:
+        pass
+
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if isinstance(a, dict) and isinstance(b, dict):
+            if len(a) != len(b):
+                return False
+            for key, value in a.items():
+                if key not in b:
+                    return False
+                stack.append((value, b[key]))
+        elif isinstance(a, list) and isinstance(b, list):
+            if len(a) != len(b):
+                return False
+            stack.extend(zip(a, b))
+        # like ==, identical elements of objects and arrays are equal
+        elif a is not b and a != b:
+            if precision is None or _round_scalar(a, precision) != _round_scalar(b, precision):
+                return False
+    return True
+
+def _count_nodes(obj, limit=None):
+    """
+    Counts objects, arrays and scalars in a value, stops
+    counting once the count reaches limit.
+    """
+    count = 0
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        count += 1
+        if limit is not None and count >= limit:
+            break
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return count
+
 def _get_opt(opts, key, default=False):
     if not opts:
         return default
@@ -59,3 +303,45 @@ def _set_opt(opts, key, val):
         opts[key] = val
     else:
         setattr(opts, key, val)
+
+class _LRUCache(object):
+    """
+    Bounded mapping evicting the least recently used entries.
+    Keeps hit and miss counters so callers can report cache efficiency.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return { 'hits': self.hits, 'misses': self.misses,
+                 'size': len(self._data), 'maxsize': self.maxsize }
+
+    def __len__(self):
+        return len(self._data)
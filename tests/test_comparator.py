@@ -0,0 +1,45 @@
+import copy
+
+from struct_diff import Comparator, diff, equal, patch, summary
+
+def test_unordered_reuse_after_mutation():
+    old = [{'x': 1}, {'y': 2}, 3]
+    new = [3, {'y': 2}, {'x': 1}]
+    comparator = Comparator({'unordered': True})
+    assert comparator.diff(old, new)['equal']
+    old[0]['x'] = 5
+    assert not comparator.diff(old, new)['equal']
+    assert comparator.diff(old, new) == Comparator({'unordered': True}).diff(old, new)
+
+def test_unordered_reuse_after_patch():
+    old = {'items': [{'id': 1, 'tags': ['a', 'b']}, {'id': 2}]}
+    new = {'items': [{'id': 1, 'tags': ['c', 'b']}, {'id': 2}]}
+    comparator = Comparator({'unordered_paths': ['items[].tags']})
+    d = comparator.diff(old, new)
+    assert not d['equal']
+    # patch() modifies old in place, the same comparator must not see the hashes from before
+    patch(old, d['result'])
+    assert comparator.diff(old, new)['equal']
+
+def test_structural_hash_reuse_after_mutation():
+    old = {'a': [{'x': 1}], 'b': {'y': 2}}
+    new = copy.deepcopy(old)
+    comparator = Comparator({'structural_hash': True})
+    assert comparator.diff(old, new)['equal']
+    old['b']['y'] = 3
+    assert comparator.diff(old, new)['result'] == {'b': {'y': {'__old': 3, '__new': 2}}}
+
+def test_summary_output_new_only():
+    opts = {'output_new_only': True}
+    assert diff({'e': 'a'}, {}, opts) is None
+    assert equal({'e': 'a'}, {}, opts)
+    assert summary({'e': 'a'}, {}, opts) == {}
+    old = {'e': 'a', 'k': [1, 2], 'o': {'z': 1}}
+    new = {'f': 1, 'k': [2], 'o': {'z': 2, 'w': 3}}
+    s = summary(old, new, dict(opts, summary_depth=2))
+    assert s.as_dict() == {
+        'f': {'added': 1, 'removed': 0, 'modified': 0},
+        'k[]': {'added': 0, 'removed': 1, 'modified': 0},
+        'o.w': {'added': 1, 'removed': 0, 'modified': 0},
+        'o.z': {'added': 0, 'removed': 0, 'modified': 1},
+    }
@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+from struct_diff import diff, to_dict, JSONFormatter, YAMLFormatter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def _load(name):
+    with open(os.path.join(HERE, name)) as f:
+        return json.load(f) if name.endswith('.json') else f.read()
+
+PAIRS = [
+    (_load('j1.json'), _load('j2.json')),
+    (_load('multi_a.json'), _load('multi_b.json')),
+    (_load('multitxt_a.txt'), _load('multitxt_b.txt')),
+    ([None, 1, {'a': None}], [None, 2, {'a': None, 'b': None}]),
+    ([{'id': 1, 'v': None}, {'id': 2, 'v': 2}, {'id': 3}], [{'id': 2, 'v': 3}, {'id': 1, 'v': None}, {'id': 4}]),
+    (None, None),
+    (5, 5),
+]
+
+OPTIONS = [
+    {},
+    {'full': True},
+    {'keep_unchanged_values': True},
+    {'output_new_only': True},
+    {'object_context': True},
+    {'keys_only': True},
+    {'precision': 1},
+    {'max_elisions': 1},
+    {'array_key': ['id']},
+    {'array_key': ['id'], 'full': True},
+]
+
+@pytest.mark.parametrize('opts', OPTIONS, ids=lambda o: ','.join(o) or 'default')
+@pytest.mark.parametrize('formatter', [JSONFormatter, YAMLFormatter], ids=lambda f: f.__name__)
+def test_typed_output_matches_dict_output(formatter, opts):
+    typed_opts = dict(opts, typed=True)
+    for old, new in PAIRS:
+        untyped = diff(old, new, opts)
+        typed = diff(old, new, typed_opts)
+        assert to_dict(typed, opts.get('output_new_only', False)) == untyped
+        assert formatter(typed, typed_opts).stringify() == formatter(untyped, opts).stringify()